@@ -1,63 +1,140 @@
 import datetime
-import pytz
+import heapq
+import operator
 from socket import gaierror
 
 from urllib.parse import urlparse
+from collections import Counter
 
+import sys
 import re
 
+try:
+    # RE2 matches in linear time, so hostile profiles can't make the
+    # patterns below backtrack for ages.
+    import re2 as _re2
+except ImportError:
+    _re2 = None
+
 from tornado.httpclient import HTTPError
-from tornado.gen import coroutine, Return, sleep
+from tornado.gen import coroutine, Return, sleep, multi, TimeoutError
 from tornado.ioloop import IOLoop
-from tornado.locks import Event
+from tornado.locks import Event, Semaphore
+from tornado.queues import Queue
 
 from ..hadapi.hadapi import UserSortBy
 from ..db.model import User, Group, Session, UserDetail, \
         UserLink, Avatar, Tag, NewestUserPageRefresh, \
         UserWord, UserWordAdjacent, UserToken, Word, WordAdjacent, \
-        DeferredUser, Hostname, UserHostname, NewUser, AvatarHash
+        DeferredUser, Hostname, UserHostname, NewUser, AvatarHash, \
+        DeletedUser
 from ..wordstat import tokenise, frequency, adjacency
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import or_
 from .. import extdlog
+from ..cache import LRUCache
 
 from .tldcache import TopLevelDomainCache
 
 from ..traits.trait import Trait
 
 
-# Patterns to look for:
-CHECK_PATTERNS = (
-        # Hyperlink
-        re.compile(r'<a .*?href=".*?">.*?</a>'),
+UTC = datetime.timezone.utc
+
+
+def _compile_untrusted(pattern):
+    """
+    Compile a pattern for matching against user-supplied text, using RE2
+    if it is available and understands the pattern, otherwise Python's own
+    regular expressions.
+    """
+    if _re2 is not None:
+        try:
+            return _re2.compile(pattern)
+        except _re2.error:
+            pass
+    return re.compile(pattern)
+
+# Users updated more recently than this are not inspected again.
+RECENT_UPDATE_AGE = datetime.timedelta(seconds=300)
+
+# Groups that users are put in by hand.  Users in any of these have been
+# classified, and are not crawled.
+MANUAL_GROUPS = frozenset(['legit', 'suspect'])
+
+
+# Patterns to look for, keyed by name:
+CHECK_PATTERNS = {
+        # Hyperlink; character classes keep the scan within the tag.
+        'hyperlink':    r'<a [^>]*href="[^"]*"[^>]*>.*?</a>',
         # US-style telephone number
-        re.compile(r'\([0-9]+?\)[ 0-9\-]+?'),
-        # International telephone number
-        re.compile(r'\+[0-9]+?[ 0-9\-]+?'),
+        'us_tel':       r'\([0-9]+?\)[ 0-9\-]+?',
         # Hybrid telephone (US/International)
-        re.compile(r'\+[0-9]+? *\([0-9]+?\)[ 0-9\-]+?'),
-)
-
-# URI whitelist
+        'hybrid_tel':   r'\+[0-9]+? *\([0-9]+?\)[ 0-9\-]+?',
+        # International telephone number
+        'intl_tel':     r'\+[0-9]+?[ 0-9\-]+?',
+}
+
+# All of the above as a single alternation, so each field is scanned once.
+# The name of the pattern that matched is given by the match's lastgroup.
+# The first alternative that matches wins, so more specific patterns must
+# come before those that would match a prefix of the same text.
+CHECK_RE = _compile_untrusted('|'.join([
+    '(?P<%s>%s)' % (name, pattern)
+    for (name, pattern) in CHECK_PATTERNS.items()
+]))
+
+# Every one of the above needs one of these characters to match, so text
+# without any of them need not be scanned.
+CHECK_TRIGGERS = ('<', '(', '+')
+
+# URI whitelist.  These are matched following the leading http:// or
+# https://.
 URI_WHITELIST = (
         # Google Plus
-        re.compile(r'^https?://plus.google.com/'),
+        r'plus.google.com/',
         # Linked In
-        re.compile(r'^https?://([a-z]{2}|www)\.linkedin\.com/in/[^/]+(|/.*)$'),
+        r'([a-z]{2}|www)\.linkedin\.com/in/[^/]+(|/.*)$',
         # Github
-        re.compile(r'^https?://github.com/[^/]+(|/.*)$'),
-        re.compile(r'^https?://github.com/?$'),
+        r'github.com/[^/]+(|/.*)$',
+        r'github.com/?$',
         # Twitter
-        re.compile(r'^https?://(mobile\.|www\.|)twitter.com/[^/]+(|/.*)$'),
-        re.compile(r'^https?://twitter.com/?$'),
+        r'(mobile\.|www\.|)twitter.com/[^/]+(|/.*)$',
+        r'twitter.com/?$',
         # Youtube
-        re.compile(r'^https?://(www.|)youtube.com/channel/'),
+        r'(www.|)youtube.com/channel/',
         # Hackaday.com
-        re.compile(r'^https?://hackaday.com(|/.*)$'),
+        r'hackaday.com(|/.*)$',
         # Hackaday.io
-        re.compile(r'^https?://hackaday.io(|/.*)$'),
+        r'hackaday.io(|/.*)$',
 )
 
+# All of the above as a single alternation.
+URI_WHITELIST_RE = _compile_untrusted(
+        '^https?://(?:%s)' % '|'.join(URI_WHITELIST))
+
+# Hosts that URI_WHITELIST accepts for any path, provided the path does not
+# begin with a second slash or span lines.  URIs like that can be accepted
+# without running URI_WHITELIST_RE.
+URI_WHITELIST_HOSTS = frozenset([
+        'plus.google.com',
+        'github.com',
+        'hackaday.com',
+        'hackaday.io',
+])
+
+
+def is_uri_whitelisted(uri):
+    """
+    Return true if the given URI points somewhere in the whitelist.
+    """
+    for scheme in ('https://', 'http://'):
+        if uri.startswith(scheme):
+            (host, slash, path) = uri[len(scheme):].partition('/')
+            if (host in URI_WHITELIST_HOSTS) and slash \
+                    and (not path.startswith('/')) and ('\n' not in path):
+                return True
+            break
+    return URI_WHITELIST_RE.match(uri) is not None
+
 
 class InvalidUser(ValueError):
     pass
@@ -67,23 +144,277 @@ class NoUsersReturned(ValueError):
     pass
 
 
+def adapt_delay(delay, full, empty, floor, ceiling):
+    """
+    Poll faster when there's a backlog, slower when there's nothing to do.
+    The delay is halved if the last pass was full, doubled if it was empty,
+    and kept within floor and ceiling.
+    """
+    if full:
+        delay /= 2.0
+    elif empty:
+        delay *= 2.0
+    return min(ceiling, max(floor, delay))
+
+
+# Queries run for each page of the newest users list.  The SQL text is
+# fixed; lists of user IDs are passed as a single array parameter.
+FRESH_PAGES_SQL = '''
+    SELECT
+        page_num
+    FROM
+        "newest_user_page_refresh"
+    WHERE
+        page_num > 1
+    AND
+        page_num >= %s
+    AND
+        page_num < %s
+    AND
+        refresh_date > (CURRENT_TIMESTAMP - make_interval(secs => %s))
+'''
+
+# Number of pages' refresh records to look up at a time
+FRESH_PAGES_WINDOW = 100
+
+# How long before a page of the newest users list is refreshed again
+PAGE_REFRESH_INTERVAL = 2592000.0   # 30 days
+
+# Deferred users due for inspection, excluding those already picked up.
+DEFERRED_IDS_SQL = '''
+    SELECT
+        user_id
+    FROM
+        "deferred_user"
+    WHERE
+        inspections < %s
+    AND
+        inspect_time < CURRENT_TIMESTAMP
+    AND
+        NOT (user_id = ANY(%s))
+    ORDER BY
+        inspect_time ASC,
+        inspections DESC
+    LIMIT 50
+'''
+
+# Push back the next inspection of deferred users, computing each user's
+# new inspect_time in the database.
+DEFERRED_CHECKED_SQL = '''
+    UPDATE
+        "deferred_user"
+    SET
+        inspections=inspections+1,
+        inspect_time=CURRENT_TIMESTAMP
+            + make_interval(secs => (%s * (inspections + 1)))
+    WHERE
+        user_id = ANY(%s)
+'''
+
+# Defer inspection of a user, backing off further each time.
+DEFER_USER_SQL = '''
+    INSERT INTO "deferred_user"
+        (user_id, inspect_time, inspections)
+    VALUES
+        (%s, CURRENT_TIMESTAMP + make_interval(secs => %s), 1)
+    ON CONFLICT ON CONSTRAINT deferred_user_pkey DO UPDATE
+    SET
+        inspect_time=CURRENT_TIMESTAMP + make_interval(
+            secs => (%s * ("deferred_user".inspections + 1))),
+        inspections="deferred_user".inspections + 1
+'''
+
+# Forget about a user that no longer exists.
+DELETE_USER_SQL = '''
+    WITH dequeued AS (
+        DELETE FROM "new_user"
+        WHERE user_id=%s
+    )
+    DELETE FROM "user"
+    WHERE user_id=%s
+'''
+
+# As above, but also record that the user no longer exists, for databases
+# that have the "deleted_user" table.
+RECORD_DELETED_USER_SQL = '''
+    WITH deleted AS (
+        INSERT INTO "deleted_user"
+            (user_id)
+        VALUES
+            (%s)
+        ON CONFLICT DO NOTHING
+    ), dequeued AS (
+        DELETE FROM "new_user"
+        WHERE user_id=%s
+    )
+    DELETE FROM "user"
+    WHERE user_id=%s
+'''
+
+# Store the hashes of an avatar (given as parallel arrays of algorithm and
+# hash data) and link them to the avatar, returning the hash rows.
+AVATAR_HASHES_SQL = '''
+    WITH input AS (
+        SELECT
+            *
+        FROM
+            unnest(%s::text[], %s::bytea[]) AS i(hashalgo, hashdata)
+    ), new_hash AS (
+        INSERT INTO "avatar_hash"
+            (hashalgo, hashdata)
+        SELECT
+            hashalgo, hashdata
+        FROM
+            input
+        ON CONFLICT DO NOTHING
+        RETURNING
+            hash_id, hashalgo, hashdata
+    ), all_hash AS (
+        SELECT
+            hash_id, hashalgo, hashdata
+        FROM
+            new_hash
+        UNION ALL
+        SELECT
+            h.hash_id, h.hashalgo, h.hashdata
+        FROM
+            "avatar_hash" h
+        JOIN
+            input USING (hashalgo, hashdata)
+    ), assoc AS (
+        INSERT INTO "avatar_hash_assoc"
+            (avatar_id, hash_id)
+        SELECT
+            %s, hash_id
+        FROM
+            all_hash
+        ON CONFLICT DO NOTHING
+    )
+    SELECT
+        hash_id, hashalgo, hashdata
+    FROM
+        all_hash
+'''
+
+# Record when a page of the newest users list was retrieved (except the
+# first, which is always retrieved) and queue up those user IDs from it that
+# we neither have, nor know to be deleted, nor have queued already,
+# returning the IDs that were queued.  This is done in one statement so
+# each page costs one round-trip.  not_deleted is filled in with
+# NOT_DELETED_SQL if the database has a "deleted_user" table.
+NEW_USER_IDS_SQL = '''
+    WITH refreshed AS (
+        INSERT INTO "newest_user_page_refresh"
+            (page_num, refresh_date)
+        SELECT
+            %%s, CURRENT_TIMESTAMP
+        WHERE
+            %%s > 1
+        ON CONFLICT ON CONSTRAINT newest_user_page_refresh_pkey
+        DO UPDATE SET
+            refresh_date=EXCLUDED.refresh_date
+    )
+    INSERT INTO "new_user"
+        (user_id)
+    SELECT
+        id
+    FROM
+        unnest(%%s) AS id
+    WHERE
+        NOT EXISTS (
+            SELECT
+                1
+            FROM
+                "user"
+            WHERE
+                user_id=id
+        )
+    %(not_deleted)s
+    ON CONFLICT DO NOTHING
+    RETURNING user_id
+'''
+
+# Skip user IDs recorded as deleted, for NEW_USER_IDS_SQL.
+NOT_DELETED_SQL = '''
+    AND
+        NOT EXISTS (
+            SELECT
+                1
+            FROM
+                "deleted_user"
+            WHERE
+                user_id=id
+        )
+'''
+
+# Take the newest users off the new user queue, returning their IDs.  Rows
+# locked by another crawler doing the same are skipped over.
+TAKE_NEW_USERS_SQL = '''
+    WITH picked AS (
+        SELECT
+            user_id
+        FROM
+            "new_user"
+        ORDER BY
+            user_id DESC
+        LIMIT 50
+        FOR UPDATE SKIP LOCKED
+    )
+    DELETE FROM "new_user"
+    WHERE
+        user_id IN (SELECT user_id FROM picked)
+    RETURNING user_id
+'''
+
+# Put users taken off the new user queue back, e.g. if inspecting them failed.
+REQUEUE_NEW_USERS_SQL = '''
+    INSERT INTO "new_user"
+        (user_id)
+    SELECT
+        id
+    FROM
+        unnest(%s) AS id
+    ON CONFLICT DO NOTHING
+'''
+
+
 class Crawler(object):
 
     DEFAULT_CONFIG = {
             'init_delay': 5.0,
             'new_user_fetch_interval': 900.0,
+            'new_user_fetch_interval_min': 60.0,
+            'new_user_fetch_interval_max': 3600.0,
             'new_check_interval': 5.0,
+            'new_check_idle_interval': 300.0,
+            'new_max_batches': 10,
             'defer_delay': 900.0,
             'deferred_check_interval': 900.0,
+            'deferred_check_interval_min': 60.0,
+            'deferred_check_interval_max': 3600.0,
             'defer_min_age': 3600.0,
             'defer_max_age': 2419200.0,
             'defer_max_count': 5,
+            'deferred_max_batches': 5,
             'old_user_fetch_interval': 300.0,
             'old_user_fetch_interval_lastpage': 604800.0,
             'admin_user_fetch_interval': 86400.0,
             'api_blocked_delay': 86400.0,
             'tld_suffix_uri': TopLevelDomainCache.PUBLICSUFFIX_URI,
             'tld_suffix_cache_duration': TopLevelDomainCache.CACHE_DURATION,
+            'tld_split_cache_size': TopLevelDomainCache.SPLIT_CACHE_SIZE,
+            'avatar_cache_size': 4096,
+            'word_cache_size': 16384,
+            'hostname_cache_size': 4096,
+            'alive_cache_size': 4096,
+            'alive_cache_duration': 3600.0,
+            'inspect_concurrency': 8,
+            'page_fetch_concurrency': 8,
+            'exception_log_interval': 60.0,
+            'timer_tick': 5.0,
+            'dns_retries': 5,
+            'dns_retry_max_delay': 30.0,
+            'dns_failure_cache_duration': 60.0,
     }
 
     def __init__(self, project_id, admin_uid, db, api, hasher, log,
@@ -105,52 +436,206 @@ class Crawler(object):
 
         self._refresh_hist_page = None
 
+        # Current polling intervals, adjusted to suit the backlog
+        self._new_user_delay = self._config['new_user_fetch_interval']
+        self._deferred_delay = self._config['deferred_check_interval']
+
         if io_loop is None:
             io_loop = IOLoop.current()
         self._io_loop = io_loop
 
+        start_time = self._io_loop.time() + self._config['init_delay']
         self._refresh_admin_group_timeout = None
-        self._io_loop.add_timeout(
-                self._io_loop.time() + self._config['init_delay'],
-                self._background_fetch_new_users)
-        self._io_loop.add_timeout(
-                self._io_loop.time() + self._config['init_delay'],
-                self._background_fetch_hist_users)
-        self._io_loop.add_timeout(
-                self._io_loop.time() + self._config['init_delay'],
-                self._background_inspect_deferred)
-        self._io_loop.add_timeout(
-                self._io_loop.time() + self._config['init_delay'],
-                self._background_inspect_new)
+        for task in (self._background_fetch_new_users,
+                self._background_fetch_hist_users,
+                self._background_inspect_deferred,
+                self._background_inspect_new):
+            self._io_loop.add_timeout(start_time, task)
 
         self._tld_cache = TopLevelDomainCache(
                 list_uri=self._config['tld_suffix_uri'],
                 cache_duration=self._config['tld_suffix_cache_duration'],
-                log=log.getChild('tldcache'))
+                split_cache_size=self._config['tld_split_cache_size'],
+                client=api.client, log=log.getChild('tldcache'))
 
         # Event to indicate when new users have been added
         self.new_user_event = Event()
 
-        # Deleted users, by ID
+        # Event to wake the new user scan when users are queued.  This is
+        # kept apart from the above, which request handlers clear.
+        self._new_user_queued = Event()
+
+        # Limit on how many users are inspected at once.  This is only safe
+        # because each inspection's transaction keeps to its own connection
+        # and never waits on the shared one or the network while it holds
+        # locks; keep it that way if _inspect_user changes.
+        self._inspect_sem = Semaphore(self._config['inspect_concurrency'])
+        self._page_fetch_sem = Semaphore(
+                self._config['page_fetch_concurrency'])
+
+        # Deleted users, by ID.  These are also kept in the database if it
+        # has a "deleted_user" table; until we know, assume it doesn't.
         self._deleted_users = set()
+        self._have_deleted_user = False
+        self._io_loop.add_callback(self._load_deleted_users)
+
+        # IDs of recently seen avatars, by URL.  Only the ID is kept, the
+        # image itself is fetched from the database when needed.
+        self._avatar_id_cache = LRUCache(self._config['avatar_cache_size'])
+
+        # Avatar images being retrieved, by avatar ID.
+        self._avatar_fetches = {}
+
+        # When each user's profile was last seen to exist, by user ID.
+        self._alive_cache = LRUCache(self._config['alive_cache_size'])
+
+        # IDs of words and host names known to be in the database.  Only
+        # the IDs are kept: scores change as users are classified.
+        self._word_id_cache = LRUCache(self._config['word_cache_size'])
+        self._hostname_id_cache = LRUCache(
+                self._config['hostname_cache_size'])
+
+        # Host names that recently failed to resolve: (expiry, error)
+        self._dns_failures = {}
+
+        # Recently logged exceptions: (last logged, times suppressed)
+        self._logged_exceptions = LRUCache(64)
+
+    def _schedule(self, delay, callback, grid=None):
+        """
+        Schedule callback to be called in roughly delay seconds.  The
+        wake-up time is rounded up to a multiple of grid (by default,
+        timer_tick seconds) so that timers falling due at about the same
+        time fire together.  Returns the timeout handle and actual delay.
+        """
+        now = self._io_loop.time()
+        when = now + delay
+        if grid is None:
+            grid = self._config['timer_tick']
+        if grid > 0:
+            when += (-when) % grid
+        return (self._io_loop.add_timeout(when, callback), when - now)
+
+    def _log_exception(self, msg, *args):
+        """
+        Log the exception being handled.  If the same error was logged
+        less than exception_log_interval seconds ago, log a one-line
+        warning instead of another full traceback.
+        """
+        ex = sys.exc_info()[1]
+        key = (msg, type(ex), str(ex))
+        now = self._io_loop.time()
+        last = self._logged_exceptions.get(key)
+
+        if (last is not None) and \
+                ((now - last[0]) < self._config['exception_log_interval']):
+            (last_time, suppressed) = last
+            suppressed += 1
+            self._logged_exceptions[key] = (last_time, suppressed)
+            self._log.warning(msg + ': %s (repeated %d times, '
+                    'traceback suppressed)', *(args + (ex, suppressed)))
+            return
+
+        self._logged_exceptions[key] = (now, 0)
+        self._log.exception(msg, *args)
 
     @coroutine
-    def get_avatar(self, avatar_url):
-        # Ensure it exists, do nothing if already present
-        yield self._db.query(
-                '''
-                INSERT INTO "avatar"
-                    (url)
-                VALUES
-                    (%s)
-                ON CONFLICT DO NOTHING
-                ''', avatar_url, commit=True)
+    def _load_deleted_users(self):
+        """
+        Load the IDs of users previously found to be deleted, so we don't
+        check on them again.  Without a "deleted_user" table, we just
+        remember the ones found since start-up.
+        """
+        try:
+            exists = yield self._db.query('''
+                SELECT to_regclass('deleted_user') IS NOT NULL
+            ''')
+            if not exists[0][0]:
+                self._log.info('No deleted_user table, '
+                        'deleted users will only be remembered in memory')
+                return
+
+            self._have_deleted_user = True
+            deleted = yield DeletedUser.fetch(self._db, 'TRUE')
+            self._deleted_users.update([d.user_id for d in deleted])
+            self._log.debug('%d users known to be deleted',
+                    len(self._deleted_users))
+        except:
+            self._log.exception('Failed to load deleted users')
+
+    @coroutine
+    def _head(self, uri):
+        """
+        Make a HEAD request, backing off exponentially if the host name
+        will not resolve.  Resolver failures are remembered for a short
+        time so a dead domain is not looked up again for every user.
+        """
+        hostname = urlparse(uri).hostname
+        failure = self._dns_failures.get(hostname)
+        if failure is not None:
+            (expiry, error) = failure
+            if expiry > self._io_loop.time():
+                raise error
+            self._dns_failures.pop(hostname, None)
+
+        attempt = 0
+        while True:
+            try:
+                result = yield self._api.api_fetch(uri, method='HEAD')
+                raise Return(result)
+            except gaierror as e:
+                attempt += 1
+                if attempt >= self._config['dns_retries']:
+                    self._dns_failures[hostname] = (
+                            self._io_loop.time()
+                            + self._config['dns_failure_cache_duration'],
+                            e)
+                    raise
+
+                self._log.debug('Failed to resolve %s (attempt %d): %s',
+                        hostname, attempt, e)
+                yield sleep(min(self._config['dns_retry_max_delay'],
+                    2 ** attempt))
 
-        # Fetch the avatar
-        avatars = yield Avatar.fetch(self._db,
-                'url=%s LIMIT 1', avatar_url)
+    @coroutine
+    def get_avatar_id(self, avatar_url):
+        """
+        Return the ID of the avatar at the given URL, creating its record
+        if need be.
+        """
+        # Have we seen this one recently?  Many users share the same avatar.
+        avatar_id = self._avatar_id_cache.get(avatar_url)
+        if avatar_id is not None:
+            raise Return(avatar_id)
+
+        # Ensure it exists, and fetch its ID in the same round-trip.  If it
+        # was already present, the INSERT returns nothing and we pick up
+        # the existing row instead.
+        rows = yield self._db.query('''
+                WITH new_avatar AS (
+                    INSERT INTO "avatar"
+                        (url)
+                    VALUES
+                        (%s)
+                    ON CONFLICT DO NOTHING
+                    RETURNING
+                        avatar_id
+                )
+                SELECT avatar_id FROM new_avatar
+                UNION ALL
+                SELECT avatar_id FROM "avatar" WHERE url=%s
+                LIMIT 1
+                ''', avatar_url, avatar_url, commit=True)
+        avatar_id = rows[0][0]
+
+        self._avatar_id_cache[avatar_url] = avatar_id
+        raise Return(avatar_id)
 
-        raise Return(avatars[0])
+    @coroutine
+    def get_avatar(self, avatar_url):
+        avatar_id = yield self.get_avatar_id(avatar_url)
+        raise Return((yield Avatar.fetch(self._db,
+                'avatar_id=%s', avatar_id, single=True)))
 
     @coroutine
     def fetch_avatar(self, avatar):
@@ -159,81 +644,202 @@ class Crawler(object):
             avatar = yield self.get_avatar(avatar)
 
         if not avatar.avatar_type:
-            # We don't have the avatar yet
-            self._log.debug('Retrieving avatar at %s',
-                    avatar.url)
-            avatar_res = yield self._api.api_fetch(
-                    avatar.url)
-            avatar.avatar_type = avatar_res.headers['Content-Type']
-            avatar.avatar=avatar_res.body
-            yield avatar.commit()
+            # We don't have the avatar yet.  Many users share the same
+            # avatar, so if it's already being retrieved, wait for that
+            # rather than downloading it again.
+            avatar_id = avatar.avatar_id
+            fetch = self._avatar_fetches.get(avatar_id)
+            if fetch is None:
+                fetch = self._fetch_avatar_data(avatar)
+                self._avatar_fetches[avatar_id] = fetch
+                fetch.add_done_callback(
+                        lambda f : self._avatar_fetches.pop(avatar_id, None))
+
+            (avatar_type, avatar_data) = yield fetch
+            if not avatar.avatar_type:
+                avatar.avatar_type = avatar_type
+                avatar.avatar = avatar_data
 
         raise Return(avatar)
 
     @coroutine
-    def _inspect_user(self, user_data, user=None, defer=True):
+    def _fetch_avatar_data(self, avatar):
+        """
+        Download an avatar and store it.  Returns its type and image data.
+        """
+        self._log.debug('Retrieving avatar at %s',
+                avatar.url)
+        avatar_res = yield self._api.api_fetch(
+                avatar.url)
+        avatar.avatar_type = avatar_res.headers['Content-Type']
+        avatar.avatar=avatar_res.body
+        yield avatar.commit()
+        raise Return((avatar.avatar_type, avatar.avatar))
+
+    @coroutine
+    def _fetch_or_create(self, db, row_class, key_column, keys, id_cache):
+        """
+        Retrieve the rows of a table (hostname or word) matching the given
+        keys, creating those that are missing, in one round-trip.  Keys
+        found in id_cache are known to exist and are fetched by ID; the
+        rest are inserted if missing and read back otherwise, without
+        locking the rows that already exist.  Returns a dict of rows by key.
+        """
+        known_ids = []
+        new_keys = []
+        for key in keys:
+            key_id = id_cache.get(key)
+            if key_id is None:
+                new_keys.append(key)
+            else:
+                known_ids.append(key_id)
+
+        # Sorted so that concurrent inspections take their locks in the
+        # same order.
+        new_keys.sort()
+
+        sql_args = {
+            'table': row_class._TABLE_,
+            'key': key_column,
+            'pk': row_class._PRIMARY_KEYS_[0],
+            'columns': ', '.join(row_class._COLUMNS_),
+        }
+        # Rows that exist already aren't visible to RETURNING, so they're
+        # picked up by the second SELECT; that one doesn't see the rows
+        # inserted by the same statement, so nothing is returned twice.
+        # ON CONFLICT names no target so that any unique constraint on the
+        # key will do.
+        rows = yield db.query('''
+            WITH input AS (
+                SELECT
+                    key
+                FROM
+                    unnest(%%s::text[]) AS key
+            ), new_rows AS (
+                INSERT INTO "%(table)s"
+                    (%(key)s, score, count)
+                SELECT
+                    key, 0, 0
+                FROM
+                    input
+                WHERE
+                    NOT EXISTS (
+                        SELECT
+                            1
+                        FROM
+                            "%(table)s"
+                        WHERE
+                            %(key)s=input.key
+                    )
+                ON CONFLICT DO NOTHING
+                RETURNING
+                    %(columns)s
+            )
+            SELECT %(columns)s FROM new_rows
+            UNION ALL
+            SELECT %(columns)s FROM "%(table)s" WHERE %(key)s = ANY(%%s)
+            UNION ALL
+            SELECT %(columns)s FROM "%(table)s" WHERE %(pk)s = ANY(%%s)
+        ''' % sql_args, new_keys, new_keys, known_ids, commit=True)
+
+        rows = dict([
+            (getattr(row, key_column), row)
+            for row in [row_class(db, r) for r in rows]
+        ])
+
+        # Rows committed by another inspection after this statement began
+        # are skipped by the INSERT, but not seen by the SELECT either.
+        # Pick them up now.
+        missing = [key for key in new_keys if key not in rows]
+        if missing:
+            rows.update([
+                (getattr(row, key_column), row)
+                for row in (yield row_class.fetch(db,
+                    '%s = ANY(%%s)' % key_column, missing))
+            ])
+
+        raise Return(rows)
+
+    @coroutine
+    def _inspect_user(self, user_data, user=None, defer=True, now=None,
+            finish=None):
         """
-        Inspect the user, see if they're worth investigating.
+        Inspect the user, see if they're worth investigating.  now may be
+        given if the caller has already read the clock.
+
+        If the user's profile is crawled, finish (if given) is called with
+        the transaction holding the results just before it is committed, so
+        the caller's own changes are committed along with them.  finish
+        must only make queries through that transaction.  Returns True if
+        finish was called.
         """
+        if now is None:
+            now = datetime.datetime.now(UTC)
         if user_data['id'] in self._deleted_users:
             self._log.trace('User %d is deleted', user_data['id'])
             return
 
+        finished = False
         try:
             if user is None:
                 users = yield User.fetch(self._db,
                         'user_id=%s', user_data['id'])
                 user = users[0]
 
+            # Have we looked at them very recently?
+            if (user.last_update is not None) \
+                    and (user.last_update > (now - RECENT_UPDATE_AGE)):
+                return
+
             # Has the user been classified?
-            user_groups = yield user.get_groups()
-            classified = ('legit' in user_groups) or ('suspect' in user_groups)
-            self._log.trace('User %s [#%d] is in groups %s (classified %s)',
-                    user.screen_name, user.user_id, user_groups, classified)
+            classified = yield user.in_groups(MANUAL_GROUPS)
+            self._log.trace('User %s [#%d] classified: %s',
+                    user.screen_name, user.user_id, classified)
 
-            # Is the link valid?
+            # Is the link valid?  Skip the check if we've seen it recently.
             try:
-                while True:
-                    try:
-                        result = yield self._api.api_fetch(
-                                user.url, method='HEAD')
-                        break
-                    except gaierror:
-                        continue
+                alive = self._alive_cache.get(user.user_id)
+                if (alive is None) or (alive < (self._io_loop.time()
+                        - self._config['alive_cache_duration'])):
+                    yield self._head(user.url)
+                    self._alive_cache[user.user_id] = self._io_loop.time()
             except HTTPError as e:
                 if e.code not in (404, 410):
                     raise
                 self._log.info('Link to user %s [#%d] no longer valid',
                         user.screen_name, user.user_id)
+                self._alive_cache.pop(user.user_id)
 
-                yield self._db.query('''
-                    DELETE FROM "new_user"
-                    WHERE user_id=%s
-                    ''', user.user_id, commit=True)
-                yield self._db.query('''
-                    DELETE FROM "user"
-                    WHERE user_id=%s
-                    CASCADE
-                    ''', user.user_id, commit=True)
-
+                if self._have_deleted_user:
+                    yield self._db.query(RECORD_DELETED_USER_SQL,
+                            user.user_id, user.user_id, user.user_id,
+                            commit=True)
+                else:
+                    yield self._db.query(DELETE_USER_SQL,
+                            user.user_id, user.user_id, commit=True)
                 self._deleted_users.add(user_data['id'])
-                raise InvalidUser('no longer valid')
 
-            if user.last_update is not None:
-                age = datetime.datetime.now(tz=pytz.utc) - user.last_update;
-                if age.total_seconds() < 300:
-                    return
+                raise InvalidUser('no longer valid')
 
             if classified:
-                match = False
+                # Someone has already made a decision on this user, nothing
+                # we find in their profile will change it.
+                self._log.trace('User %s [#%d] already classified, '\
+                        'not crawling their profile',
+                        user.screen_name, user.user_id)
+                return
             else:
                 # Tokenise the users' content.
-                user_freq = {}
-                user_host_freq = {}
-                user_adj_freq = {}
-                user_tokens = {}
-                def tally(field):
-                    wordlist = tokenise(field)
+                user_freq = Counter()
+                user_host_freq = Counter()
+                user_adj_freq = Counter()
+                user_tokens = Counter()
+                def tally(text):
+                    if not text:
+                        # Nothing to tokenise
+                        return
+
+                    wordlist = tokenise(text)
                     frequency(wordlist, user_freq)
                     if len(wordlist) > 2:
                         adjacency(wordlist, user_adj_freq)
@@ -245,38 +851,64 @@ class Crawler(object):
                 match = False
                 for field in ('about_me', 'who_am_i', 'location',
                         'what_i_would_like_to_do'):
-                    for pattern in CHECK_PATTERNS:
-                        pmatch = pattern.search(user_data[field])
-                        if pmatch:
-                            self._log.info('Found match for %s (%r) in '\
-                                    '%s of %s [#%d]',
-                                    pattern.pattern, pmatch.group(0), field,
-                                    user_data['screen_name'], user_data['id'])
-                            try:
-                                user_tokens[pmatch.group(0)] += 1
-                            except KeyError:
-                                user_tokens[pmatch.group(0)] = 1
+                    text = user_data.get(field)
+                    if not text:
+                        continue
 
-                            match = True
-                            break
+                    if not any(c in text for c in CHECK_TRIGGERS):
+                        # Nothing the patterns could match.
+                        tally(text)
+                        continue
+
+                    for pmatch in CHECK_RE.finditer(text):
+                        self._log.info('Found match for %s (%r) in '\
+                                '%s of %s [#%d]',
+                                pmatch.lastgroup,
+                                pmatch.group(0), field,
+                                user_data['screen_name'], user_data['id'])
+                        user_tokens[pmatch.group(0)] += 1
+
+                        match = True
 
                     # Tally up word usage in this field.
-                    tally(user_data[field])
+                    tally(text)
+
+                # Retrieve the user's links, projects and pages.  None of
+                # these depend on each other, so fetch them all at once.
+                @coroutine
+                def fetch_or_log(what, fetch_fn):
+                    try:
+                        result = yield self._fetch_all_pages(
+                                fetch_fn, user.user_id)
+                    except Exception:
+                        self._log.error('Failed to retrieve user %s %s',
+                                user, what, exc_info=1)
+                        # Carry on!
+                        result = []
+                    raise Return(result)
+
+                fetches = {
+                        'links': self._fetch_all_pages(
+                            self._api.get_user_links, user.user_id),
+                        'pages': fetch_or_log('pages',
+                            self._api.get_user_pages),
+                }
+                if user_data.get('projects'):
+                    fetches['projects'] = fetch_or_log('projects',
+                            self._api.get_user_projects)
+                fetched = yield multi(fetches)
 
                 # Does the user have any hyperlinks?  Not an indicator that they're
                 # a spammer, just one of the traits.
-                pg_idx = 1
-                pg_cnt = 1  # Don't know how many right now, but let's start here
-                while pg_idx <= pg_cnt:
-                    link_res = yield self._api.get_user_links(user.user_id,
-                            page=pg_idx, per_page=50)
+                user_links = {}
+                for link_res in fetched['links']:
                     self._log.trace('Retrieved user %s link page %d of %d',
                             user,
-                            link_res.get('page',pg_idx),
-                            link_res.get('last_page',pg_cnt))
+                            link_res.get('page',1),
+                            link_res.get('last_page',1))
                     if link_res['links'] == 0:
                         # No links, yes sometimes it's an integer.
-                        break
+                        continue
 
                     try:
                         for link in link_res['links']:
@@ -286,16 +918,18 @@ class Crawler(object):
 
                             # Count the link title up
                             tally(link['title'])
+                            link_uri = urlparse(link['url'])
 
                             try:
                                 # Count up the hostname/domain frequencies
-                                uri_domains = yield self._tld_cache.splitdomain(
-                                        urlparse(link['url']).hostname)
-
-                                for hostname in uri_domains:
-                                    user_host_freq[hostname] = \
-                                            user_host_freq.get(hostname, 0) + 1
-                            except:
+                                uri_domains = self._tld_cache.cached_split(
+                                        link_uri.hostname)
+                                if uri_domains is None:
+                                    uri_domains = yield \
+                                            self._tld_cache.splitdomain(
+                                                link_uri.hostname)
+                                user_host_freq.update(uri_domains)
+                            except Exception:
                                 self._log.warning(
                                     'Failed to count up domain frequency for '
                                     'user %s [#%d] link %s <%s>',
@@ -303,83 +937,45 @@ class Crawler(object):
                                     user_data['id'],
                                     link['title'], link['url'], exc_info=1)
 
-                            # Insert the link if not already present.
-                            yield self._db.query(
-                                    '''
-                                    INSERT INTO "user_link"
-                                        (user_id, url, title)
-                                    VALUES
-                                        (%s, %s, title)
-                                    ON CONFLICT DO UPDATE
-                                    SET
-                                        title=%s
-                                    WHERE
-                                        user_id=%s
-                                    AND
-                                        url=%s
-                            ''', user.user_id, link['url'],
-                                link['title'], link['title'],
-                                user.user_id, link['url'],
-                                commit=True)
+                            # Stash the link for insertion below.
+                            user_links[link['url']] = link['title']
 
                             if not match:
                                 # Ignore the link if it's in the whitelist
-                                uri_matched = False
-                                for pattern in URI_WHITELIST:
-                                    if pattern.match(link['url']):
-                                        uri_matched = True
-                                        break
-
-                                match = match or (not uri_matched)
-                    except:
-                        self._log.error('Failed to process link result %r', link_res)
+                                match = not is_uri_whitelisted(
+                                        link['url'])
+                    except Exception:
+                        self._log.error('Failed to process user %s link '
+                                'page %s', user, link_res.get('page', 1),
+                                exc_info=1)
                         raise
-                    pg_cnt = link_res['last_page']
-
-                    # Next page
-                    pg_idx = link_res['page'] + 1
 
                 # Does the user have a lot of projects in a short time?
-                age = (datetime.datetime.now(tz=pytz.utc) - \
+                age = (now - \
                         user.had_created).total_seconds()
 
                 # How about the content of those projects?
-                if user_data.get('projects'):
-                    try:
-                        pg_idx = 1
-                        pg_cnt = 1
-                        while pg_idx <= pg_cnt:
-                            prj_res = yield self._api.get_user_projects(
-                                    user.user_id,
-                                    page=pg_idx, per_page=50)
-                            self._log.audit('Projects for %s: %s',
-                                    user, prj_res)
-
-                            raw_projects = prj_res.get('projects')
-                            if isinstance(raw_projects, list):
-                                for raw_prj in raw_projects:
-                                    # Tokenise the name, summary and description
-                                    for field in ('name', 'summary', 'description'):
-                                        if field not in raw_prj:
-                                            continue
-                                        tally(raw_prj[field])
-
-                            pg_cnt = prj_res.get('last_page',1)
-
-                            # Next page
-                            pg_idx = prj_res.get('page',1) + 1
-                    except:
-                        self._log.error('Failed to process user %s projects',
-                                user, exc_info=1)
-                        # Carry on!
+                try:
+                    for prj_res in fetched.get('projects', []):
+                        self._log.audit('Projects for %s: %s',
+                                user, prj_res)
+
+                        raw_projects = prj_res.get('projects')
+                        if isinstance(raw_projects, list):
+                            for raw_prj in raw_projects:
+                                # Tokenise the name, summary and description
+                                for field in ('name', 'summary', 'description'):
+                                    if field not in raw_prj:
+                                        continue
+                                    tally(raw_prj[field])
+                except Exception:
+                    self._log.error('Failed to process user %s projects',
+                            user, exc_info=1)
+                    # Carry on!
 
                 # How about the user's pages?
                 try:
-                    pg_idx = 1
-                    pg_cnt = 1
-                    while pg_idx <= pg_cnt:
-                        page_res = yield self._api.get_user_pages(user.user_id,
-                                page=pg_idx, per_page=50)
+                    for page_res in fetched['pages']:
                         self._log.audit('Pages for %s: %s',
                                 user, page_res)
 
@@ -391,12 +987,7 @@ class Crawler(object):
                                     if field not in raw_page:
                                         continue
                                     tally(raw_page[field])
-
-                        pg_cnt = page_res.get('last_page',1)
-
-                        # Next page
-                        pg_idx = page_res.get('page',1) + 1
-                except:
+                except Exception:
                     self._log.error('Failed to process user %s pages',
                             user, exc_info=1)
                     # Carry on!
@@ -407,359 +998,401 @@ class Crawler(object):
                             user.screen_name, user.user_id, user_data['projects'], age)
                     match = True
 
-                # Stash any tokens
-                for token, count in user_tokens.items():
-                    if count > 0:
-                        yield self._db.query('''
-                            INSERT INTO "user_token"
-                                (user_id, token, count)
-                            VALUES
-                                (%s, %s, %s)
-                            ON CONFLICT ON CONSTRAINT user_token_pkey DO UPDATE
-                            SET
-                                count=%s
-                            WHERE
-                                user_id=%s
-                            AND
-                                token=%s
-                            ''', user.user_id, token, count,
-                            count, user.user_id, token,
-                            commit=True)
-                    else:
-                        yield self._db.query('''
-                            DELETE FROM "user_token"
-                            WHERE
-                                user_id=%s
-                            AND
-                                token=%s
-                        ''', user.user_id, token, commit=True)
-
-                # Retrieve all the hostnames
-                if user_host_freq:
-                    yield self._db.query('''
-                        INSERT INTO "hostname"
-                            (hostname, score, count)
-                        VALUES
-                            %(insert_template)s
-                        ON CONFLICT ON CONSTRAINT hostname_pkey DO NOTHING
-                    ''' % {
-                        'insert_template': ', '.join([
-                            '(%s, 0, 0)' for x
-                            in range(0, len(user_host_freq))
-                        ])
-                    }, *tuple(user_host_freq.keys()), commit=True)
-
-                    hostnames = dict([
-                        (h.hostname, h) for h in
-                        (yield Hostname.fetch(self._db,
-                            'hostname IN %s',
-                            tuple(user_host_freq.keys())))
-                    ])
-                else:
-                    hostnames = {}
-
-                # Retrieve all the words
-                if user_freq:
-                    yield self._db.query('''
-                        INSERT INTO "word"
-                            (word, score, count)
-                        VALUES
-                            %(insert_template)s
-                        ON CONFLICT ON CONSTRAINT ix_word_word DO NOTHING
-                    ''' % {
-                        'insert_template': ', '.join([
-                            '(%s, 0, 0)' for x
-                            in range(0, len(user_freq))
+                # Assess the user's traits.  This reads through the shared
+                # connection and may fetch avatars, so it must be done before
+                # the transaction below starts taking locks.
+                traits = yield Trait.assess(user,
+                        self._log.getChild('user%d' % user.user_id))
+
+                # Everything we learn about the user from here on is written
+                # in a single transaction, committed once we are done.  Only
+                # queries through txn may be made until then.
+                txn = yield self._db.begin()
+                try:
+                    # Insert the links, or update their titles if already present.
+                    if user_links:
+                        yield UserLink.upsert(txn, [
+                            (user.user_id, title, url)
+                            for (url, title) in user_links.items()
+                        ], update=('title',))
+
+                    # Stash any tokens
+                    if user_tokens:
+                        yield UserToken.upsert(txn, [
+                            (user.user_id, token, count)
+                            for (token, count) in user_tokens.items()
                         ])
-                    }, *tuple(user_freq.keys()), commit=True)
-
-                    words = dict([
-                        (w.word, w) for w in
-                        (yield Word.fetch(self._db,
-                            'word IN %s',
-                            tuple(user_freq.keys())))
-                    ])
-                else:
-                    words = {}
-
-                # Retrieve all the word adjacencies
-                if user_adj_freq:
-                    yield self._db.query('''
-                        INSERT INTO "word_adjacenct"
-                            (proceeding_id, following_id, score, count)
-                        VALUES
-                            %(insert_template)s
-                        ON CONFLICT ON CONSTRAINT word_adjacent_pkey DO NOTHING
-                    ''' % {
-                        'insert_template': ', '.join([
-                            '(%s, %s, 0, 0)' for x
-                            in range(0, len(user_freq))
+
+                    # Retrieve all the hostnames and words
+                    if user_host_freq:
+                        hostnames = yield self._fetch_or_create(txn,
+                                Hostname, 'hostname', user_host_freq.keys(),
+                                self._hostname_id_cache)
+                    else:
+                        hostnames = {}
+
+                    if user_freq:
+                        words = yield self._fetch_or_create(txn,
+                                Word, 'word', user_freq.keys(),
+                                self._word_id_cache)
+                    else:
+                        words = {}
+
+                    # Retrieve all the word adjacencies
+                    if user_adj_freq:
+                        # Sorted to avoid deadlocks, as above.
+                        adj_ids = sorted([
+                            (words[proc_w].word_id, words[follow_w].word_id)
+                            for (proc_w, follow_w) in user_adj_freq.keys()
                         ])
-                    }, *tuple([
-                            word[w].word_id
-                            for w in sum(user_adj_freq.keys(), ())
-                        ]),
-                        commit=True)
-
-                # There's no clean way I know of to retrieve
-                # composite keys in an IN query.
-                word_adj = {}
-                for (proc_w, follow_w) in user_adj_freq.keys():
-                    word_adjs = yield WordAdjacent.fetch(self._db,
-                            'proceeding_id=%s AND following_id=%s',
-                            word[proc_w], word[follow_w])
-                    word_adj[(proc_w, follow_w)] = word_adjs[0]
-
-                # Add the user words, compute user's score
-                score = []
-                for word, count in user_freq.items():
-                    w = words[word]
-                    if count > 0:
-                        yield self._db.query('''
-                            INSERT INTO "user_word"
-                                (user_id, word_id, count)
+                        yield txn.query_values('''
+                            INSERT INTO "word_adjacent"
+                                (proceeding_id, following_id, score, count)
                             VALUES
-                                (%s, %s, %s)
-                            ON CONFLICT ON CONSTRAINT user_word_pkey DO UPDATE
-                            SET
-                                count=%s
-                            WHERE
-                                user_id=%s
-                            AND
-                                word_id=%s
-                        ''', user.user_id, w.word_id, count,
-                            count, user.user_id,
-                            w.word_id, commit=True)
+                                %s
+                            ON CONFLICT ON CONSTRAINT word_adjacent_pkey DO NOTHING
+                        ''', adj_ids, template='(%s, %s, 0, 0)')
+
+                    # Retrieve the word adjacencies in one go by matching the
+                    # composite key against parallel arrays of proceeding and
+                    # following IDs.
+                    if user_adj_freq:
+                        adj_keys = [
+                            (words[proc_w].word_id, words[follow_w].word_id)
+                            for (proc_w, follow_w) in user_adj_freq.keys()
+                        ]
+                        word_adj = dict([
+                            ((wa.proceeding_id, wa.following_id), wa)
+                            for wa in (yield WordAdjacent.fetch(txn,
+                                '(proceeding_id, following_id) IN '
+                                '(SELECT * FROM unnest(%s, %s))',
+                                [k[0] for k in adj_keys],
+                                [k[1] for k in adj_keys]))
+                        ])
                     else:
-                        yield self._db.query('''
+                        word_adj = {}
+
+                    # Add the user words, compute user's score
+                    score = []
+                    user_word_rows = []
+                    user_word_drop = []
+                    for word, count in user_freq.items():
+                        w = words[word]
+                        if count > 0:
+                            user_word_rows.append(
+                                    (user.user_id, w.word_id, count))
+                        else:
+                            user_word_drop.append(w.word_id)
+
+                        if w.count > 0:
+                            score.append(float(w.score) / float(w.count))
+
+                    if user_word_rows:
+                        yield UserWord.upsert(txn, user_word_rows)
+
+                    if user_word_drop:
+                        yield txn.query('''
                             DELETE FROM "user_word"
                             WHERE
                                 user_id=%s
                             AND
-                                word_id=%s''',
-                                user.user_id, w.word_id,
-                                commit=True)
-
-                    if w.count > 0:
-                        score.append(float(w.score) / float(w.count))
-
-                # Add the user host names
-                for hostname, count in user_host_freq.items():
-                    h = hostnames[hostname]
-                    if count > 0:
-                        yield self._db.query('''
-                            INSERT INTO "user_hostname"
-                                (user_id, hostname_id, count)
-                            VALUES
-                                (%s, %s, %s)
-                            ON CONFLICT ON CONSTRAINT user_hostname_pkey DO UPDATE
-                            SET
-                                count=%s
-                            WHERE
-                                user_id=%s
-                            AND
-                                hostname_id=%s
-                        ''', user.user_id, h.hostname_id, count,
-                            count, user.user_id,
-                            h.hostname_id, commit=True)
-                    else:
-                        yield self._db.query('''
+                                word_id = ANY(%s)''',
+                                user.user_id, user_word_drop)
+
+                    # Add the user host names
+                    user_host_rows = []
+                    user_host_drop = []
+                    for hostname, count in user_host_freq.items():
+                        h = hostnames[hostname]
+                        if count > 0:
+                            user_host_rows.append(
+                                    (user.user_id, h.hostname_id, count))
+                        else:
+                            user_host_drop.append(h.hostname_id)
+
+                        if h.count > 0:
+                            score.append(float(h.score) / float(h.count))
+
+                    if user_host_rows:
+                        yield UserHostname.upsert(txn, user_host_rows)
+
+                    if user_host_drop:
+                        yield txn.query('''
                             DELETE FROM "user_hostname"
                             WHERE
                                 user_id=%s
                             AND
-                                hostname_id=%s''',
-                                user.user_id, h.hostname_id,
-                                commit=True)
-
-                    if h.count > 0:
-                        score.append(float(h.score) / float(h.count))
-
-                # Add the user word adjcancies
-                for (proc_word, follow_word), count in user_adj_freq.items():
-                    wa = word_adj[(proc_word, follow_word)]
-                    proc_w = words[proc_word]
-                    follow_w = words[follow_word]
-
-                    if count > 0:
-                        yield self._db.query('''
-                            INSERT INTO "user_word_adjacent"
-                                (user_id, proceeding_id, following_id, count)
-                            VALUES
-                                (%s, %s, %s, %s)
-                            ON CONFLICT ON CONSTRAINT user_word_adjacent_pkey DO UPDATE
-                            SET
-                                count=%s
+                                hostname_id = ANY(%s)''',
+                                user.user_id, user_host_drop)
+
+                    # Add the user word adjcancies
+                    user_adj_rows = []
+                    user_adj_drop = []
+                    for (proc_word, follow_word), count in user_adj_freq.items():
+                        proc_w = words[proc_word]
+                        follow_w = words[follow_word]
+
+                        if count > 0:
+                            user_adj_rows.append((user.user_id,
+                                proc_w.word_id, follow_w.word_id, count))
+                        else:
+                            user_adj_drop.append(
+                                    (proc_w.word_id, follow_w.word_id))
+
+                        wa = word_adj.get((proc_w.word_id, follow_w.word_id))
+                        if (wa is not None) and (wa.count > 0):
+                            score.append(float(wa.score) / float(wa.count))
+
+                    if user_adj_rows:
+                        yield UserWordAdjacent.upsert(txn, user_adj_rows)
+
+                    if user_adj_drop:
+                        yield txn.query('''
+                            DELETE FROM "user_word_adjacent"
                             WHERE
                                 user_id=%s
                             AND
-                                proceeding_id=%s
-                            AND
-                                following_id=%s
-                        ''', user.user_id, proc_w.word_id,
-                            follow_w.word_id, count,
-                            count, user.user_id, proc_w.word_id,
-                            follow_w.word_id, commit=True)
+                                (proceeding_id, following_id) IN (
+                                    SELECT * FROM unnest(%s, %s)
+                                )''',
+                                user.user_id,
+                                [k[0] for k in user_adj_drop],
+                                [k[1] for k in user_adj_drop])
+
+                    # Append each traits' weighted score
+                    score.extend([t.weighted_score for t in traits])
+                    yield Trait.persist_many(txn, traits)
+
+                    # Compute score from the 10 lowest scores
+                    score = sum(heapq.nsmallest(10, score))
+
+                    # Defer if there's nothing to score yet, or the account
+                    # is too new to judge, unless it's too old to bother.
+                    needs_defer = defer \
+                            and (age < self._config['defer_max_age']) \
+                            and ((abs(score) < 0.5) \
+                                or (age < self._config['defer_min_age']))
+
+                    if needs_defer:
+                        yield txn.query(DEFER_USER_SQL, user_data['id'],
+                                self._config['defer_delay'],
+                                self._config['defer_delay'])
                     else:
-                        yield self._db.query('''
-                            DELETE FROM "user_word_adjacent"
+                        yield txn.query('''
+                            DELETE FROM "deferred_user"
                             WHERE
                                 user_id=%s
-                            AND
-                                proceeding_id=%s
-                            AND
-                                following_id=%s''',
-                                user.user_id, proc_w.word_id,
-                                follow_w.word_id, commit=True)
-
-                    if wa.count > 0:
-                        score.append(float(wa.score) / float(wa.count))
-
-                # Append each traits' weighted score
-                for trait in Trait.assess(user,
-                        self._log.getChild('user%d' % user.user_id)):
-                    score.append(trait.weighted_score)
-                    trait.persist()
-
-                # Compute score
-                score.sort()
-                score = sum(score[:10])
-
-                if (defer and (abs(score < 0.5) \
-                        or (age < self._config['defer_min_age']))) \
-                        and (age < self._config['defer_max_age']):
-                    # There's nothing to score.  Inspect again later.
-
-                    yield self._db.query('''
-                        INSERT INTO "deferred_user"
-                            (user_id, inspect_time, inspections)
-                        VALUES
-                            (%s, CURRENT_TIMESTAMP + make_interval(secs => %s), 1)
-                        ON CONFLICT ON CONSTRAINT deferred_user_pkey DO UPDATE
-                        SET
-                            inspect_time=CURRENT_TIMESTAMP + make_interval(secs => (%s * (inspections+1))),
-                            inspections=inspections+1
-                        WHERE
-                            user_id=%s''', user_data['id'],
-                            config['defer_delay'],
-                            config['defer_delay'],
-                            user_data['id'], commit=True)
-                else:
-                    yield self._db.query('''
-                        DELETE FROM "deferred_user"
-                        WHERE
-                            user_id=%s
-                        ''', user_data['id'], commit=True)
+                            ''', user_data['id'])
+
+                    self._log.debug('User %s [#%d] has score %f',
+                            user.screen_name, user.user_id, score)
+                    if score < -0.5:
+                        match = True
+
+                    # Auto-classify the user
+                    if match:
+                        self._log.debug('Auto-classifying %s [#%d] as suspect',
+                                user.screen_name, user.user_id)
+                        yield user.add_groups(('auto_suspect',), db=txn)
+                        yield user.rm_groups(('auto_legit',), db=txn)
+                    else:
+                        self._log.debug('Auto-classifying %s [#%d] as legitmate',
+                                user.screen_name, user.user_id)
+                        yield user.add_groups(('auto_legit',), db=txn)
+                        yield user.rm_groups(('auto_suspect',), db=txn)
+
+                    # Record the user information
+                    yield UserDetail.upsert(txn, [(
+                        user_data['id'],
+                        user_data['about_me'],
+                        user_data['who_am_i'],
+                        user_data['what_i_would_like_to_do'],
+                        user_data['location'],
+                        user_data['projects'],
+                    )], update=('about_me', 'who_am_i',
+                        'what_i_would_like_to_do', 'location', 'projects'))
+
+                    if finish is not None:
+                        yield finish(txn)
+                        finished = True
+                except:
+                    yield txn.rollback()
+                    raise
+                yield txn.commit()
 
-                self._log.debug('User %s [#%d] has score %f',
-                        user.screen_name, user.user_id, score)
-                if score < -0.5:
-                    match = True
+                # The words and host names are now committed, remember them.
+                for w in words.values():
+                    self._word_id_cache[w.word] = w.word_id
+                for h in hostnames.values():
+                    self._hostname_id_cache[h.hostname] = h.hostname_id
 
-                # Record the user information
-                yield self._db.query('''
-                    INSERT INTO "user_detail"
-                        (user_id, about_me, who_am_i, location,
-                         projects, what_i_would_like_to_do)
-                    VALUES
-                        (%s, %s, %s, %s, %s, %s)
-                    ON CONFLICT ON CONSTRAINT user_detail_pkey DO UPDATE
-                    SET
-                        about_me=%s,
-                        who_am_i=%s,
-                        location=%s,
-                        projects=%s,
-                        what_i_would_like_to_do=%s
-                    WHERE
-                        user_id=%s
-                ''',
-                    user_data['id'],
-                    user_data['about_me'],
-                    user_data['who_am_i'],
-                    user_data['location'],
-                    user_data['projects'],
-                    user_data['what_i_would_like_to_do'],
-                    user_data['about_me'],
-                    user_data['who_am_i'],
-                    user_data['location'],
-                    user_data['projects'],
-                    user_data['what_i_would_like_to_do'],
-                    user_data['id'], commit=True)
-
-            if match:
-                # Auto-Flag the user as "suspect"
-                if not classified:
-                    self._log.debug('Auto-classifying %s [#%d] as suspect',
-                            user.screen_name, user.user_id)
-                    yield user.add_groups('auto_suspect')
-                    yield user.rm_groups('auto_legit')
-            elif not classified:
-                # Auto-Flag the user as "legit"
-                self._log.debug('Auto-classifying %s [#%d] as legitmate',
-                        user.screen_name, user.user_id)
-                yield user.add_groups('auto_legit')
-                yield user.rm_groups('auto_suspect')
-
-            # Remove the user from the "new" list
-            yield self._db.query('''
-                DELETE FROM "new_user"
-                WHERE user_id=%s
-                ''', user_data['id'], commit=True)
             self._log.audit('Finished inspecting %s', user_data)
         except:
             self._log.error('Failed to process user data %r',
                     user_data, exc_info=1)
             raise
 
+        raise Return(finished)
+
+    @coroutine
+    def _update_users_from_data(self, users_data, **kwargs):
+        """
+        Update several users from API data concurrently, with at most
+        inspect_concurrency users in progress at a time.  A failure with
+        one user is logged and does not stop the others.  The whole batch
+        is treated as being updated at the same moment.
+
+        Returns the list of users updated successfully.
+        """
+        kwargs.setdefault('now', datetime.datetime.now(UTC))
+
+        # Load the users we already have in one go.
+        ids = [u['id'] for u in users_data if u.get('id')]
+        if ids:
+            kwargs['known_users'] = dict([
+                (user.user_id, user) for user in (yield User.fetch(self._db,
+                    'user_id = ANY(%s)', ids))
+            ])
+
+        @coroutine
+        def _update(user_data):
+            try:
+                user = yield self.update_user_from_data(
+                        user_data, **kwargs)
+            except InvalidUser:
+                user = None
+            except:
+                self._log_exception('Failed to update user %s',
+                        user_data.get('id'))
+                user = None
+            raise Return(user)
+
+        users = yield multi([_update(user_data) for user_data in users_data])
+        raise Return([user for user in users if user is not None])
+
+    @coroutine
+    def _fetch_all_pages(self, fetch_fn, *args, per_page=50, **kwargs):
+        """
+        Retrieve every page of a paginated API call.  The first page tells
+        us how many pages there are, the rest are then fetched concurrently.
+        The number of page requests in flight at once is capped to avoid
+        tripping the API's rate limits.
+        """
+        @coroutine
+        def _fetch_page(page):
+            with (yield self._page_fetch_sem.acquire()):
+                raise Return((yield fetch_fn(*args, page=page,
+                    per_page=per_page, **kwargs)))
+
+        first = yield _fetch_page(1)
+        try:
+            last_page = int(first.get('last_page') or 1)
+        except (TypeError, ValueError):
+            last_page = 1
+
+        if last_page > 1:
+            rest = yield multi([
+                _fetch_page(page)
+                for page in range(2, last_page + 1)
+            ])
+        else:
+            rest = []
+
+        raise Return([first] + rest)
+
     @coroutine
     def update_user_from_data(self, user_data, inspect_all=True,
-            defer=True):
+            defer=True, dequeue=True, now=None, known_users=None):
         """
         Update a user in the database from data retrieved via the API.
+        If dequeue is False, the caller takes care of removing the user
+        from the new user list.  now may be given if the caller has already
+        read the clock.  known_users may be given as a dict of the existing
+        users loaded by the caller, by ID; users not in it are taken to be
+        new.
+
+        At most inspect_concurrency users are updated at a time, no matter
+        which of the background tasks (or request handlers) asked.
         """
+        with (yield self._inspect_sem.acquire()):
+            user = yield self._update_user_from_data(user_data,
+                    inspect_all=inspect_all, defer=defer, dequeue=dequeue,
+                    now=now, known_users=known_users)
+        raise Return(user)
+
+    @coroutine
+    def _update_user_from_data(self, user_data, inspect_all, defer,
+            dequeue, now=None, known_users=None):
         self._log.audit('Inspecting user data: %s', user_data)
-        avatar = yield self.get_avatar(user_data['image_url'])
+        if now is None:
+            now = datetime.datetime.now(UTC)
+        avatar_id = yield self.get_avatar_id(user_data['image_url'])
         user_created = datetime.datetime.fromtimestamp(
-                        user_data['created'], tz=pytz.utc)
+                        user_data['created'], tz=UTC)
 
         # See if the user exists:
-        user = yield User.fetch(self._db, 'user_id=%s', user_data['id'], single=True)
+        if known_users is not None:
+            user = known_users.get(user_data['id'])
+        else:
+            user = yield User.fetch(self._db, 'user_id=%s', user_data['id'],
+                    single=True)
         if user is None:
-            # Nope, create the user.
-            yield self._db.query('''
+            # Nope, create the user, getting the new row back as we go.
+            rows = yield self._db.query('''
                 INSERT INTO "user"
                     (user_id, screen_name, url, avatar_id, created,
                      had_created)
                 VALUES
-                    (%s, %s, %s, %s, CURRENT_TIMESTAMP, %s)
-                ''',
+                    (%%s, %%s, %%s, %%s, CURRENT_TIMESTAMP, %%s)
+                ON CONFLICT DO NOTHING
+                RETURNING %(columns)s
+                ''' % {
+                    'columns': ', '.join(User._COLUMNS_),
+                },
                     user_data['id'], user_data['screen_name'],
-                    user_data['url'], avatar.avatar_id,
+                    user_data['url'], avatar_id,
                     user_created, commit=True)
-            # Try again
-            user = yield User.fetch(self._db, 'user_id=%s', user_data['id'], single=True)
+            if rows:
+                user = User(self._db, rows[0])
+            else:
+                # Someone else created them in the meantime.
+                user = yield User.fetch(self._db, 'user_id=%s',
+                        user_data['id'], single=True)
         else:
-            # Update the user
+            # Update the user; this is written out with last_update below.
             user.screen_name = user_data['screen_name']
             user.url = user_data['url']
-            user.avatar_id = avatar.avatar_id
-            user.last_update = datetime.datetime.now(tz=pytz.utc)
-            yield user.commit()
+            user.avatar_id = avatar_id
 
-        # Inspect the user
-        if inspect_all or (user.last_update is None):
-            yield self._inspect_user(user_data, user=user, defer=defer)
-            user.last_update = datetime.datetime.now(tz=pytz.utc)
-            yield user.commit()
+        @coroutine
+        def _finish(db):
+            user.last_update = now
+            yield user.commit(db=db)
 
-        self._log.debug('User %s up-to-date', user)
+            if dequeue:
+                # User clearly exists, so remove it from the new user list
+                yield db.query('''
+                    DELETE FROM "new_user"
+                    WHERE user_id=%s
+                    ''', user.user_id, commit=True)
 
-        # User clearly exists, so remove it from the new user list
-        yield self._db.query('''
-            DELETE FROM "new_user"
-            WHERE user_id=%s
-            ''', user.user_id, commit=True)
+        # Inspect the user; if their profile gets crawled, the user is
+        # written out in the same transaction as the results.
+        finished = False
+        if inspect_all or (user.last_update is None):
+            finished = yield self._inspect_user(user_data, user=user,
+                    defer=defer, now=now, finish=_finish)
 
+        if not finished:
+            txn = yield self._db.begin()
+            try:
+                yield _finish(txn)
+            except:
+                yield txn.rollback()
+                raise
+            yield txn.commit()
+
+        self._log.debug('User %s up-to-date', user)
         raise Return(user)
 
     @coroutine
@@ -781,6 +1414,7 @@ class Crawler(object):
         """
         page = 1
         page_count = 0
+        num_uids = 0
         if self._refresh_hist_page is None:
             self._refresh_hist_page = yield self._fetch_last_refresh_page()
 
@@ -788,29 +1422,25 @@ class Crawler(object):
             while (page < max([self._refresh_hist_page,2])) \
                     and (page_count < 10):
                 self._log.info('Scanning for new users page %d', page)
-                page = yield self.fetch_new_user_ids(
+                (page, page_uids) = yield self.fetch_new_user_ids(
                         page=page, inspect_all=True,
                         defer=True)
+                num_uids += page_uids
                 page_count += 1
         except NoUsersReturned:
             # Okay, so we've got nothing, move along.
             pass
-        except SQLAlchemyError:
-            # SQL cock up, roll back.
-            self._db.rollback()
-            self._log.exception('Failed to retrieve newer users'\
-                    ': database rolled back')
         except:
-            self._log.exception('Failed to retrieve newer users')
-
-        delay = self._config['new_user_fetch_interval']
-        next_time = self._io_loop.time()
-        next_time += (delay - (next_time % delay))
-        delay = next_time - self._io_loop.time()
+            self._log_exception('Failed to retrieve newer users')
+
+        self._new_user_delay = adapt_delay(self._new_user_delay,
+                full=(page_count >= 10), empty=(num_uids == 0),
+                floor=self._config['new_user_fetch_interval_min'],
+                ceiling=self._config['new_user_fetch_interval_max'])
+        # Line this up on a multiple of the interval
+        (_, delay) = self._schedule(0, self._background_fetch_new_users,
+                grid=self._new_user_delay)
         self._log.info('Next new user scan in %.3f sec', delay)
-        self._io_loop.add_timeout(
-                self._io_loop.time() + delay,
-                self._background_fetch_new_users)
 
     @coroutine
     def _background_inspect_deferred(self):
@@ -818,67 +1448,93 @@ class Crawler(object):
         Inspect previously deferred users
         """
         if not self._api.is_forbidden:
-            delay = self._config['deferred_check_interval']
+            seen_ids = []
+            full = False
             self._log.info('Scanning deferred users')
+
+            @coroutine
+            def _fetch_ids():
+                # Grab a handful of deferred users we haven't seen yet
+                ids = yield self._db.query(DEFERRED_IDS_SQL,
+                        self._config['defer_max_count'], list(seen_ids))
+                raise Return([r[0] for r in ids])
+
             try:
-                # Grab a handful of deferred users
-                ids = yield self._db.query('''
-                    SELECT
-                        user_id
-                    FROM
-                        "deferred_user"
-                    WHERE
-                        inspections < %s
-                    AND
-                        inspect_time < CURRENT_TIMESTAMP
-                    ORDER BY
-                        inspect_time ASC,
-                        inspections DESC
-                    LIMIT 50''',
-                    self._config['defer_max_count'])
-                ids = [r[0] for r in ids]
-
-                if ids:
+                ids = yield _fetch_ids()
+                while ids:
                     self._log.trace('Scanning %s', ids)
+                    seen_ids.extend(ids)
+                    full = (len(ids) >= 50)
 
                     user_data = yield self._api.get_users(ids=ids, per_page=50)
                     self._log.audit('Received deferred users: %s', user_data)
-                    if isinstance(user_data['users'], list):
-                        for this_user_data in user_data['users']:
-                            while True:
-                                try:
-                                    yield self.update_user_from_data(
-                                            this_user_data, inspect_all=True)
-                                    break
-                                except InvalidUser:
-                                    pass
-                                except SQLAlchemyError:
-                                    self._db.rollback()
+
+                    # Look up the next batch whilst this one is inspected
+                    if full and (len(seen_ids) <
+                            (50 * self._config['deferred_max_batches'])):
+                        next_ids = _fetch_ids()
                     else:
-                        # Mark as checked
-                        yield self._db.query('''
-                            UPDATE
-                                "deferred_user"
-                            SET
-                                inspections=inspections+1,
-                                inspect_time=CURRENT_TIMESTAMP
-                                    + make_interval(secs => (%s * (inspections + 1)))
-                            WHERE
-                                user_id IN %s
-                        ''', self._config['defer_delay'],
-                            tuple(ids), commit=True)
+                        next_ids = None
+
+                    try:
+                        unchecked = set(ids)
+                        if isinstance(user_data['users'], list):
+                            # Inspect the batch concurrently; failures are
+                            # logged per user and don't stop the others.
+                            updated = yield self._update_users_from_data(
+                                    user_data['users'], inspect_all=True)
+                            unchecked.difference_update([
+                                user.user_id for user in updated
+                            ])
+
+                        if unchecked:
+                            # Mark those not returned, or that failed, as
+                            # checked, all at once
+                            yield self._db.query(DEFERRED_CHECKED_SQL,
+                                    self._config['defer_delay'],
+                                    sorted(unchecked), commit=True)
+                    except:
+                        # Don't leave the look-up of the next batch
+                        # dangling; collect (and log) its outcome first.
+                        if next_ids is not None:
+                            try:
+                                yield next_ids
+                            except:
+                                self._log_exception(
+                                        'Failed to fetch deferred user IDs')
+                        raise
+
+                    if next_ids is None:
+                        break
+                    ids = yield next_ids
 
                 self._log.debug('Successfully fetched deferred users')
             except:
-                self._log.exception('Failed to retrieve deferred users')
+                self._log_exception('Failed to retrieve deferred users')
+
+            self._deferred_delay = adapt_delay(self._deferred_delay,
+                    full=full, empty=(not seen_ids),
+                    floor=self._config['deferred_check_interval_min'],
+                    ceiling=self._config['deferred_check_interval_max'])
+            delay = self._deferred_delay
         else:
             self._log.warning('API blocked, cannot inspect deferred users')
             delay = self._config['api_blocked_delay']
 
-        self._log.info('Next deferred user scan in %.3f sec', delay)
-        self._io_loop.add_timeout(
-                self._io_loop.time() + delay,
+        (_, delay) = self._schedule(delay,
                 self._background_inspect_deferred)
+        self._log.info('Next deferred user scan in %.3f sec', delay)
+
+    @coroutine
+    def _requeue_new_users(self, ids):
+        """
+        Put users taken off the new user queue back on it.
+        """
+        try:
+            yield self._db.query(REQUEUE_NEW_USERS_SQL, list(ids),
+                    commit=True)
+        except:
+            self._log_exception('Failed to requeue new users %s', ids)
 
     @coroutine
     def _background_inspect_new(self):
@@ -888,57 +1544,114 @@ class Crawler(object):
         if not self._api.is_forbidden:
             delay = self._config['new_check_interval']
             self._log.info('Scanning new users')
+
+            # Anything queued from here on will be picked up by the next scan.
+            self._new_user_queued.clear()
+            found = False
+            # Users taken off the queue that need another go.  These are
+            # put back once the scan is over, so this scan doesn't pick
+            # them straight up again.
+            retry_ids = set()
             try:
-                # Grab a handful of new users
-                ids = yield self._db.query('''
-                    SELECT
-                        user_id
-                    FROM
-                        "new_user"
-                    ORDER BY
-                        user_id DESC
-                    LIMIT 50''')
-                ids = [r[0] for r in ids]
-
-                if ids:
-                    self._log.debug('Scanning %s', ids)
-
-                    user_data = yield self._api.get_users(
-                            ids=ids, per_page=50)
-                    self._log.audit('Received new users: %s', user_data)
-                    if isinstance(user_data['users'], list):
-                        user_data['users'].sort(
-                                key=lambda u : u.get('id') or 0,
-                                reverse=True)
-                        for this_user_data in user_data['users']:
-                            user = yield self.update_user_from_data(
-                                    this_user_data, inspect_all=True)
-
-                # Clean up the new user list
-                yield self._db.query('''
-                    DELETE FROM
-                        "new_user"
-                    WHERE
-                        user_id IN (
-                            SELECT
-                                user_id
-                            FROM
-                                "user"
-                            WHERE
-                                user_id IN %s
-                        )
-                ''', tuple(ids), commit=True)
+                # Fetch the next batch from the API whilst the current one
+                # is being inspected.
+                batches = Queue(maxsize=2)
+
+                @coroutine
+                def _fetch_batches():
+                    nonlocal found
+                    try:
+                        for batch_num in range(
+                                self._config['new_max_batches']):
+                            if self._api.is_forbidden:
+                                break
+
+                            # Take a handful of new users off the queue
+                            ids = yield self._db.query(TAKE_NEW_USERS_SQL,
+                                    commit=True)
+                            ids = sorted([r[0] for r in ids], reverse=True)
+                            if not ids:
+                                break
+
+                            found = True
+                            self._log.debug('Scanning %s', ids)
+
+                            # Until they're handed over for inspection,
+                            # these are ours to put back.
+                            retry_ids.update(ids)
+                            user_data = yield self._api.get_users(
+                                    ids=ids, per_page=50)
+                            retry_ids.difference_update(ids)
+
+                            self._log.audit('Received new users: %s',
+                                    user_data)
+                            if isinstance(user_data['users'], list):
+                                yield batches.put((ids, user_data['users']))
+                    except:
+                        # Logged here rather than raised, so that we don't
+                        # finish before the batches being inspected.
+                        self._log_exception('Failed to retrieve new users')
+                    finally:
+                        yield batches.put(None)
+
+                @coroutine
+                def _inspect_batches():
+                    while True:
+                        batch = yield batches.get()
+                        if batch is None:
+                            break
+
+                        (ids, users_data) = batch
+                        try:
+                            for u in users_data:
+                                if not u.get('id'):
+                                    u['id'] = 0
+                            users_data.sort(key=operator.itemgetter('id'),
+                                    reverse=True)
+                            updated = yield self._update_users_from_data(
+                                    users_data, inspect_all=True,
+                                    dequeue=False)
+                            if updated:
+                                # Let waiting request handlers know
+                                self.new_user_event.set()
+
+                            # Put back those that failed, so they're tried
+                            # again.  Those the API didn't return, or that
+                            # turned out to be deleted, are dropped.
+                            failed = set([u['id'] for u in users_data]) \
+                                    .intersection(ids) \
+                                    .difference([u.user_id for u in updated]) \
+                                    .difference(self._deleted_users)
+                            retry_ids.update(failed)
+                        except:
+                            self._log_exception(
+                                    'Failed to inspect new users')
+                            retry_ids.update(ids)
+
+                yield multi([_fetch_batches(), _inspect_batches()])
                 self._log.debug('Successfully fetched new users')
             except:
-                self._log.exception('Failed to retrieve new users')
+                self._log_exception('Failed to retrieve new users')
+
+            if retry_ids:
+                yield self._requeue_new_users(sorted(retry_ids))
+
+            if not found:
+                # Nothing to do.  Rather than polling an empty queue, sleep
+                # until new users are queued, checking now and then anyway.
+                try:
+                    yield self._new_user_queued.wait(
+                            timeout=datetime.timedelta(
+                                seconds=self._config['new_check_idle_interval']))
+                except TimeoutError:
+                    pass
+                delay = 0
         else:
             delay = self._config['api_blocked_delay']
             self._log.warning('API blocked, cannot inspect new users')
 
+        (_, delay) = self._schedule(delay, self._background_inspect_new)
         self._log.info('Next new user scan in %.3f sec', delay)
-        self._io_loop.add_timeout(
-                self._io_loop.time() + delay,
-                self._background_inspect_new)
 
     @coroutine
     def _background_fetch_hist_users(self):
@@ -952,50 +1665,49 @@ class Crawler(object):
             self._refresh_hist_page = yield self._fetch_last_refresh_page()
 
         try:
-            self._refresh_hist_page = \
+            (self._refresh_hist_page, _) = \
                     yield self.fetch_new_user_ids(
                         page=self._refresh_hist_page,
                         defer=False)
-        except SQLAlchemyError:
-            # SQL cock up, roll back.
-            self._db.rollback()
-            self._log.exception('Failed to retrieve older users'\
-                    ': database rolled back')
         except NoUsersReturned:
             self._log.info('Last user page reached')
             delay = self._config['old_user_fetch_interval_lastpage']
         except:
-            self._log.exception('Failed to retrieve older users')
+            self._log_exception('Failed to retrieve older users')
 
-        self._log.info('Next historical user fetch in %.3f sec', delay)
-        self._io_loop.add_timeout(
-                self._io_loop.time() + delay,
+        (_, delay) = self._schedule(delay,
                 self._background_fetch_hist_users)
+        self._log.info('Next historical user fetch in %.3f sec', delay)
 
     @coroutine
     def fetch_new_user_ids(self, page=1, inspect_all=False, defer=True):
         """
         Retrieve new users IDs not currently known from the Hackaday.io API.
+        Returns the next page to retrieve and the number of new IDs found.
         """
-        last_refresh = None
         num_uids = 0
         pages = 0
 
-        now = datetime.datetime.now(tz=pytz.utc)
+        # Pages refreshed in the last 30 days are skipped for now.  These
+        # are looked up a window of pages at a time as we go.  The first
+        # page is never skipped.
+        fresh_pages = set()
+        fresh_end = page
+
         while (num_uids < 10) and (pages < 10):
-            if page > 1:
-                last_refresh = yield NewestUserPageRefresh.fetch(self._db, 'page_num=%s', page)
-                if len(last_refresh) == 1:
-                    last_refresh = last_refresh[0]
-                    self._log.audit('Page %s last refreshed on %s',
-                            last_refresh.page_num, last_refresh.refresh_date)
-                    if (now - last_refresh.refresh_date).total_seconds() \
-                            < 2592000.0:    # 30 days
-                        # Skip this page for now
-                        self._log.audit('Skipping page %d', page)
-                        page += 1
-                        yield sleep(0.001)
-                        continue
+            while True:
+                if page >= fresh_end:
+                    fresh_end = page + FRESH_PAGES_WINDOW
+                    rows = yield self._db.query(FRESH_PAGES_SQL,
+                            page, fresh_end, PAGE_REFRESH_INTERVAL)
+                    fresh_pages = set([r[0] for r in rows])
+
+                if page not in fresh_pages:
+                    break
+
+                # Skip this page for now
+                self._log.audit('Skipping page %d', page)
+                page += 1
 
             self._log.trace('Retrieving newest user page %d', page)
             ids = yield self._api.get_user_ids(sortby=UserSortBy.newest,
@@ -1006,46 +1718,16 @@ class Crawler(object):
                 # Nothing returned, so stop here
                 raise NoUsersReturned()
 
-            if page > 1:
-                if last_refresh is None:
-                    self._log.debug('Adding page %s refresh time %s',
-                            page, now)
-                    last_refresh = NewestUserPageRefresh(
-                            page_num=page, refresh_date=now)
-                    self._db.add(last_refresh)
-                else:
-                    self._log.debug('Updating page %s refresh time %s',
-                            page, now)
-                    last_refresh.refresh_date = now
-                self._db.commit()
-
-            # Filter out the users we already have.  Create new user objects
-            # for the ones we don't have.
-            existing_ids = yield self._db.query('''
-                SELECT
-                    user_id
-                FROM
-                    "users"
-                WHERE
-                    user_id IN %s
-                ''', tuple(ids))
-            existing_ids = set([r[0] for r in existing_ids])
-
-            ids = list(filter(
-                lambda id : id not in existing_ids,
-                ids))
-
-            yield self._db.query('''
-                INSERT INTO "new_user"
-                    (user_id)
-                VALUES
-                    %(value_template)s
-                ON CONFLICT DO NOTHING
-            ''' % {
-                'value_template': ', '.join([
-                    '(%s)' for x in ids
-                ])
-            }, tuple(ids), commit=True)
+            # Record the page refresh time and queue up the users we don't
+            # already have or know about, all in one statement.
+            ids = yield self._db.query(NEW_USER_IDS_SQL % {
+                        'not_deleted': NOT_DELETED_SQL
+                            if self._have_deleted_user else '',
+                    }, page, page, list(ids), commit=True)
+            num_uids += len(ids)
+            if ids:
+                # Wake up the new user scan
+                self._new_user_queued.set()
 
             page += 1
             pages += 1
@@ -1054,62 +1736,51 @@ class Crawler(object):
                 # No more IDs to fetch
                 break
 
-        raise Return(page)
+        raise Return((page, num_uids))
 
     @coroutine
-    def _get_avatar_hashes(self, avatar_id):
-        hashes = {}
-        for algo in ('sha512','average_hash','dhash','phash','whash'):
-            hashes[algo] = yield self.get_avatar_hash(algo, avatar_id)
-        raise Return(hashes)
+    def get_avatar_hashes(self, algorithms, avatar_id):
+        """
+        Retrieve the hashes of an avatar for the given algorithms, computing
+        and storing any we don't have yet.  Returns a dict of AvatarHash
+        by algorithm, or None if there's no such avatar.
+        """
+        # Do we have the hashes on file already?  If so, there's no need
+        # to load the image.
+        hashes = yield AvatarHash.fetch_for_avatar(self._db, avatar_id)
+        missing = [a for a in algorithms if a not in hashes]
+
+        if missing:
+            avatar = yield Avatar.fetch(self._db,
+                    'avatar_id=%s', avatar_id, single=True)
+            if avatar is None:
+                return
+
+            if not avatar.avatar_type:
+                yield self.fetch_avatar(avatar)
+
+            # Compute them all from the one copy of the image
+            hash_data = yield self._hasher.hash_all(avatar, missing)
+
+            # Store the hashes and link them to the avatar.
+            rows = yield self._db.query(AVATAR_HASHES_SQL,
+                    missing, [hash_data[a] for a in missing],
+                    avatar.avatar_id, commit=True)
+            hashes.update(dict([
+                (h.hashalgo, h) for h in
+                [AvatarHash(self._db, row) for row in rows]
+            ]))
+
+            self._log.debug('Generated new hashes for avatar %d: %s',
+                    avatar_id, ', '.join(missing))
+
+        raise Return(dict([
+            (a, hashes.get(a)) for a in algorithms
+        ]))
 
     @coroutine
     def get_avatar_hash(self, algorithm, avatar_id):
-        avatars = yield Avatar.fetch(self._db,
-                'avatar_id=%s', avatar_id)
-        if len(avatars) != 1:
+        hashes = yield self.get_avatar_hashes((algorithm,), avatar_id)
+        if hashes is None:
             return
-
-        avatar = avatars[0]
-        del avatars
-
-        if not avatar.avatar_type:
-            yield self.fetch_avatar(avatar)
-
-        # Do we have the hash on file already?
-        hashes = yield avatar.get_hashes()
-        avatar_hash = hashes.get(algorithm)
-
-        if avatar_hash is None:
-            # We need to retreive it
-            hash_data = yield self._hasher.hash(avatar, algorithm)
-
-            # Create the hash instance if not already present
-            yield self._db.query('''
-                INSERT INTO "avatar_hash"
-                    (hashalgo, hashdata)
-                VALUES
-                    (%s, %s)
-                ON CONFLICT DO NOTHING
-            ''', algorithm, hash_data, commit=True)
-
-            # Fetch the hash instance.
-            avatar_hashes = yield AvatarHash.fetch(self._db,
-                    'hashalgo=%s AND hashdata=%s',
-                    algorithm, hash_data)
-            avatar_hash = avatar_hashes[0]
-
-            # Associate the hash with the avatar
-            yield self._db.query('''
-                INSERT INTO "avatar_hash_assoc"
-                    (avatar_id, hash_id)
-                VALUES
-                    (%s, %s)
-                ON CONFLICT DO NOTHING''',
-                avatar.avatar_id, avatar_hash.hash_id,
-                commit=True)
-
-            self._log.debug('Generated new hash for avatar %d algorithm %s',
-                    avatar_id, algorithm)
-
-        raise Return(avatar_hash)
+        raise Return(hashes[algorithm])
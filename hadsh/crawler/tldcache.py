@@ -11,14 +11,17 @@ from tornado.gen import coroutine, Return
 from tornado.ioloop import IOLoop
 from tornado.locks import Event
 
+from ..cache import LRUCache
+
 
 class TopLevelDomainCache(object):
 
     PUBLICSUFFIX_URI = 'https://publicsuffix.org/list/public_suffix_list.dat'
     CACHE_DURATION = 604800.0   # 1 week
+    SPLIT_CACHE_SIZE = 16384
 
     def __init__(self, list_uri=PUBLICSUFFIX_URI, cache_duration=CACHE_DURATION,
-            client=None, log=None):
+            split_cache_size=SPLIT_CACHE_SIZE, client=None, log=None):
 
         if client is None:
             client = AsyncHTTPClient()
@@ -33,6 +36,9 @@ class TopLevelDomainCache(object):
 
         self._list = None
 
+        # Results of splitdomain, by domain name.
+        self._split_cache = LRUCache(split_cache_size)
+
     @coroutine
     def refresh(self):
         if self._cache_expiry > time():
@@ -49,8 +55,26 @@ class TopLevelDomainCache(object):
                         response.body.decode('utf-8').split('\n')))
 
         self._cache_expiry = int(time()) + self._cache_duration
+
+        # Previous results may no longer be valid
+        self._split_cache.clear()
         self._log.debug('Cached %d entries', len(self._list))
 
+    def cached_split(self, domain):
+        """
+        Return the result of splitdomain for the given domain if it is
+        known and the listing is still fresh, otherwise return None.
+        This avoids the coroutine machinery for the common case of a
+        domain that has been seen before.
+        """
+        if self._cache_expiry <= time():
+            return None
+
+        result = self._split_cache.get(domain)
+        if result is None:
+            return None
+        return list(result)
+
     @coroutine
     def splitdomain(self, domain):
         """
@@ -64,13 +88,20 @@ class TopLevelDomainCache(object):
         ]
         """
         # First ensure our cache is fresh
-        try:
-            yield self.refresh()
-        except:
-            # Just log if we have something to work from
-            if self._list is None:
-                raise
-            self._log.warning('Failed to refresh cache', exc_info=1)
+        if self._cache_expiry <= time():
+            try:
+                yield self.refresh()
+            except:
+                # Just log if we have something to work from
+                if self._list is None:
+                    raise
+                self._log.warning('Failed to refresh cache', exc_info=1)
+
+        # Have we seen this domain before?
+        result = self._split_cache.get(domain)
+        if result is not None:
+            raise Return(list(result))
+        fqdn = domain
 
         # Strip out any idna encoded bits.  This might fail if we're
         # given a domain with the IDNA stuff worked out already or if
@@ -88,4 +119,5 @@ class TopLevelDomainCache(object):
             if suffix not in self._list:
                 result.append(suffix)
 
+        self._split_cache[fqdn] = tuple(result)
         raise Return(result)
@@ -1,8 +1,11 @@
 from psycopg2 import connect
+from psycopg2.extras import execute_values
 from tornado.ioloop import IOLoop
 from tornado.gen import coroutine, Return
+from tornado.locks import Semaphore
 from concurrent.futures import Future
 import threading
+import time
 
 try:
     from urllib.parse import urlparse
@@ -10,10 +13,27 @@ except ImportError:
     from urlparse import urlparse
 
 
+# Number of rows sent per statement by query_values
+VALUES_PAGE_SIZE = 1000
+
+
 class Database(object):
-    def __init__(self, db_uri, **kwargs):
+
+    POOL_SIZE       = 10
+    MAX_OVERFLOW    = 20
+    POOL_RECYCLE    = 1800.0
+
+    def __init__(self, db_uri, pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW, pool_recycle=POOL_RECYCLE,
+            pool_pre_ping=True, **kwargs):
         """
         Parse the database URI and keyword arguments.
+
+        Transactions are given connections from a pool: up to pool_size
+        idle connections are kept, and at most pool_size + max_overflow
+        transactions may be in progress at once.  Pooled connections older
+        than pool_recycle seconds are replaced, and if pool_pre_ping is
+        set, are tested before being handed out.
         """
         parsed_uri = urlparse(db_uri)
 
@@ -64,9 +84,127 @@ class Database(object):
             user=user, password=password,
             host=host, port=port, **kwargs)
 
+        # Connection used for stand-alone queries
+        self._conn = DatabaseConnection(self._db_args, log=self._log)
+
+        # Idle connections available for transactions
+        self._txn_conns = []
+        self._txn_sem = Semaphore(pool_size + max_overflow)
+        self._pool_size = pool_size
+        self._pool_recycle = pool_recycle
+        self._pool_pre_ping = pool_pre_ping
+
+
+    @coroutine
+    def connect(self):
+        """
+        Connect to the server
+        """
+        yield self._conn.connect()
+
+
+    def close(self):
+        self._conn.close()
+        while self._txn_conns:
+            self._txn_conns.pop().close()
+
+
+    def query(self, sql, *args, commit=False):
+        return self._conn.query(sql, *args, commit=commit)
+
+
+    def query_values(self, sql, rows, template=None, commit=False,
+            fetch=False):
+        return self._conn.query_values(sql, rows, template=template,
+                commit=commit, fetch=fetch)
+
+
+    @coroutine
+    def begin(self):
+        """
+        Begin a transaction.  The transaction is given a connection to
+        itself until it is committed or rolled back.  Any locks it takes are
+        held until then, so don't wait on queries through the shared
+        connection, or on the network, while it is open.
+        """
+        yield self._txn_sem.acquire()
+        try:
+            conn = None
+            while self._txn_conns:
+                conn = self._txn_conns.pop()
+                if (yield self._check(conn)):
+                    break
+                conn.close()
+                conn = None
+
+            if conn is None:
+                conn = DatabaseConnection(self._db_args, log=self._log)
+                yield conn.connect()
+        except:
+            self._txn_sem.release()
+            raise
+
+        raise Return(Transaction(self, conn))
+
+
+    @coroutine
+    def _check(self, conn):
+        """
+        Check an idle connection is still fit for use.
+        """
+        if (not conn.connected) or (conn.age > self._pool_recycle):
+            raise Return(False)
+
+        if self._pool_pre_ping:
+            try:
+                yield conn.ping()
+            except Exception:
+                if self._log:
+                    self._log.info('Discarding dead pooled connection',
+                            exc_info=1)
+                raise Return(False)
+
+        raise Return(True)
+
+
+    def _release(self, conn):
+        """
+        Return a transaction's connection to the idle list.
+        """
+        if len(self._txn_conns) < self._pool_size:
+            self._txn_conns.append(conn)
+        else:
+            conn.close()
+        self._txn_sem.release()
+
+
+class DatabaseConnection(object):
+    """
+    A single connection to the database, serviced by its own thread.
+    """
+    def __init__(self, db_args, log=None):
+        self._db_args = db_args
+        self._log = log
+
         self._conn_ioloop = None
         self._conn_thread = None
         self._conn = None
+        self._connect_time = None
+
+
+    @property
+    def connected(self):
+        return (self._conn is not None) and (not self._conn.closed)
+
+
+    @property
+    def age(self):
+        """
+        Return how long, in seconds, we have been connected.
+        """
+        if self._connect_time is None:
+            return 0.0
+        return time.monotonic() - self._connect_time
 
 
     @coroutine
@@ -90,6 +228,7 @@ class Database(object):
                 self._conn = conn
                 self._conn_ioloop = io_loop
                 self._conn_thread = thread
+                self._connect_time = time.monotonic()
                 future.set_result(None)
             except Exception as ex:
                 io_loop.stop()
@@ -111,10 +250,20 @@ class Database(object):
         self._conn = None
         self._conn_ioloop = None
         self._conn_thread = None
+        self._connect_time = None
 
 
     @coroutine
-    def query(self, sql, *args, commit=False):
+    def _run(self, fn, sql=None, args=None):
+        """
+        Run fn(conn) in the connection thread and return its result.
+        """
+        if (self._conn is not None) and self._conn.closed:
+            # The connection was lost, start again.
+            if self._log:
+                self._log.warning('Database connection lost, reconnecting')
+            self.close()
+
         if self._conn is None:
             yield self.connect()
 
@@ -122,31 +271,159 @@ class Database(object):
         assert self._conn_ioloop is not None
 
         future = Future()
-        def _query():
+        def _call():
             try:
-                with self._conn:
-                    with self._conn.cursor() as cur:
-                        cur = self._conn.cursor()
-                        cur.execute(sql, args)
-
-                        if cur.description:
-                            res = cur.fetchall()
-                        else:
-                            res = None
-
-                        if commit:
-                            self._conn.commit()
-
-                        future.set_result(res)
+                future.set_result(fn(self._conn))
             except Exception as ex:
                 future.set_exception(ex)
-        self._conn_ioloop.add_callback(_query)
+        self._conn_ioloop.add_callback(_call)
 
         try:
             result = yield future
         except:
-            if self._log:
+            if self._log and (sql is not None):
                 self._log.exception('Failed SQL query:\n%s\nARGS: %s',
                         sql, args)
             raise
         raise Return(result)
+
+
+    @staticmethod
+    def _execute(conn, sql, args):
+        with conn.cursor() as cur:
+            cur.execute(sql, args)
+
+            if cur.description:
+                return cur.fetchall()
+            else:
+                return None
+
+
+    def query(self, sql, *args, commit=False):
+        """
+        Run a stand-alone query.
+        """
+        def _query(conn):
+            with conn:
+                res = self._execute(conn, sql, args)
+
+                if commit:
+                    conn.commit()
+
+                return res
+        return self._run(_query, sql, args)
+
+
+    def query_in_transaction(self, sql, *args):
+        """
+        Run a query as part of the transaction in progress.
+        """
+        return self._run(lambda conn : self._execute(conn, sql, args),
+                sql, args)
+
+
+    @staticmethod
+    def _execute_values(conn, sql, rows, template, fetch):
+        with conn.cursor() as cur:
+            return execute_values(cur, sql, rows, template=template,
+                    page_size=VALUES_PAGE_SIZE, fetch=fetch)
+
+
+    def query_values(self, sql, rows, template=None, commit=False,
+            fetch=False):
+        """
+        Run a stand-alone query over many rows.  sql contains a single %s
+        where the VALUES list goes; psycopg2 fills it in from rows, each
+        formatted according to template.  If fetch is set, the rows
+        returned (e.g. by RETURNING) are given back.
+        """
+        def _query(conn):
+            with conn:
+                res = self._execute_values(conn, sql, rows, template, fetch)
+
+                if commit:
+                    conn.commit()
+
+                return res
+        return self._run(_query, sql, rows)
+
+
+    def query_values_in_transaction(self, sql, rows, template=None,
+            fetch=False):
+        """
+        Run a query over many rows as part of the transaction in progress.
+        """
+        return self._run(lambda conn : self._execute_values(conn,
+                sql, rows, template, fetch), sql, rows)
+
+
+    def ping(self):
+        """
+        Check the server is still there.
+        """
+        def _ping(conn):
+            self._execute(conn, 'SELECT 1', ())
+            conn.rollback()
+        return self._run(_ping)
+
+
+    def commit(self):
+        return self._run(lambda conn : conn.commit())
+
+
+    def rollback(self):
+        return self._run(lambda conn : conn.rollback())
+
+
+class Transaction(object):
+    """
+    A database transaction.  Queries made through this object take effect
+    together when commit() is called, or not at all if rollback() is
+    called instead.
+    """
+    def __init__(self, db, conn):
+        self._db = db
+        self._conn = conn
+
+
+    def query(self, sql, *args, commit=False):
+        """
+        Run a query within the transaction.  commit is accepted so this
+        may be used in place of Database.query, but is ignored: call
+        commit() once all queries have been made.
+        """
+        assert self._conn is not None, 'Transaction has finished'
+        return self._conn.query_in_transaction(sql, *args)
+
+
+    def query_values(self, sql, rows, template=None, commit=False,
+            fetch=False):
+        """
+        Run a query over many rows within the transaction.  As with
+        query, commit is ignored.
+        """
+        assert self._conn is not None, 'Transaction has finished'
+        return self._conn.query_values_in_transaction(sql, rows,
+                template=template, fetch=fetch)
+
+
+    @coroutine
+    def commit(self):
+        try:
+            yield self._conn.commit()
+        finally:
+            self._finish()
+
+
+    @coroutine
+    def rollback(self):
+        try:
+            yield self._conn.rollback()
+        finally:
+            self._finish()
+
+
+    def _finish(self):
+        if self._conn is not None:
+            self._db._release(self._conn)
+            self._conn = None
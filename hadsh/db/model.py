@@ -25,21 +25,31 @@ class Row(object):
 
 
     @classmethod
-    @coroutine
-    def fetch(cls, db, where, *args, single=False):
-        rows = yield db.query(
-                '''
+    def _select_sql(cls):
+        """
+        Return the SELECT statement (up to the WHERE clause) for this
+        table.  This is generated once per class then re-used.
+        """
+        # Look in this class only, sub-classes may have other columns.
+        sql = cls.__dict__.get('_SELECT_SQL_')
+        if sql is None:
+            sql = '''
                     SELECT
                         %(columns)s
                     FROM
                         "%(table)s"
                     WHERE
-                        %(where)s
                 ''' % {
                     'columns': ', '.join(cls._COLUMNS_),
                     'table': cls._TABLE_,
-                    'where': where
-                }, *args)
+                }
+            cls._SELECT_SQL_ = sql
+        return sql
+
+    @classmethod
+    @coroutine
+    def fetch(cls, db, where, *args, single=False):
+        rows = yield db.query(cls._select_sql() + where, *args)
         res = [
             cls(db, row) for row in rows
         ]
@@ -52,6 +62,38 @@ class Row(object):
         else:
             raise Return(res)
 
+    @classmethod
+    def upsert(cls, db, rows, update=('count',)):
+        """
+        Insert the given rows (tuples of values for each column) in a single
+        statement.  Rows that clash with an existing primary key have the
+        columns listed in update overwritten instead, unless they already
+        hold those values, in which case the row is left alone.
+        """
+        return db.query_values('''
+            INSERT INTO "%(table)s"
+                (%(columns)s)
+            VALUES
+                %%s
+            ON CONFLICT ON CONSTRAINT %(table)s_pkey DO UPDATE
+            SET
+                %(updates)s
+            WHERE
+                (%(current)s) IS DISTINCT FROM (%(excluded)s)
+        ''' % {
+            'table': cls._TABLE_,
+            'columns': ', '.join(cls._COLUMNS_),
+            'updates': ', '.join([
+                '%s=EXCLUDED.%s' % (c, c) for c in update
+            ]),
+            'current': ', '.join([
+                '"%s".%s' % (cls._TABLE_, c) for c in update
+            ]),
+            'excluded': ', '.join([
+                'EXCLUDED.%s' % c for c in update
+            ]),
+        }, rows, commit=True)
+
     @coroutine
     def refresh(self):
         # Exclude primary keys from the column list
@@ -87,7 +129,7 @@ class Row(object):
         self._data.update(dict(zip(data_columns, rows[0])))
 
     @coroutine
-    def commit(self):
+    def commit(self, db=None):
         try:
             dirty_data      = self._dirty.copy()
             self._dirty     = {}
@@ -112,7 +154,7 @@ class Row(object):
                         ])
                 }
 
-            yield self._db.query(sql,
+            yield (db or self._db).query(sql,
                     *tuple(dirty_args + where_args),
                     commit=True)
             self._data.update(dirty_data)
@@ -179,17 +221,40 @@ class User(Row):
         ]))
 
     @coroutine
-    def set_groups(self, groups):
+    def in_groups(self, groups, db=None):
+        """
+        Return whether this user is in any of the groups named.
+        """
+        rows = yield (db or self._db).query(
+                '''
+                SELECT EXISTS (
+                    SELECT
+                        1
+                    FROM
+                        "group" g,
+                        "user_group_assoc" uga
+                    WHERE
+                        g.group_id=uga.group_id
+                    AND
+                        uga.user_id=%s
+                    AND
+                        g.name = ANY(%s)
+                )
+        ''', self.user_id, list(groups))
+        raise Return(rows[0][0])
+
+    @coroutine
+    def set_groups(self, groups, db=None):
         """
         Set the list of groups linked to this user.
         """
-        yield self.add_groups(groups)
-        yield self.mask_groups(groups)
+        yield self.add_groups(groups, db=db)
+        yield self.mask_groups(groups, db=db)
 
     @coroutine
-    def add_groups(self, groups):
+    def add_groups(self, groups, db=None):
         # Add the new groups
-        yield self._db.query('''
+        yield (db or self._db).query('''
             INSERT INTO "user_group_assoc"
                 (user_id, group_id)
             SELECT
@@ -197,45 +262,45 @@ class User(Row):
             FROM
                 "group"
             WHERE
-                name IN %s
+                name = ANY(%s)
             ON CONFLICT DO NOTHING
-        ''', self.user_id, tuple(groups))
+        ''', self.user_id, list(groups))
 
     @coroutine
-    def rm_groups(self, groups):
+    def rm_groups(self, groups, db=None):
         # Remove groups listed listed
-        yield self._db.query('''
+        yield (db or self._db).query('''
             DELETE FROM "user_group_assoc"
             WHERE
-                user_id=%S
+                user_id=%s
             AND
                 group_id IN (
                     SELECT
-                        %s, group_id
+                        group_id
                     FROM
                         "group"
                     WHERE
-                        name IN %s
+                        name = ANY(%s)
                 )
-        ''', self.user_id, tuple(groups))
+        ''', self.user_id, list(groups))
 
     @coroutine
-    def mask_groups(self, groups):
+    def mask_groups(self, groups, db=None):
         # Remove groups not listed
-        yield self._db.query('''
+        yield (db or self._db).query('''
             DELETE FROM "user_group_assoc"
             WHERE
-                user_id=%S
+                user_id=%s
             AND
                 group_id NOT IN (
                     SELECT
-                        %s, group_id
+                        group_id
                     FROM
                         "group"
                     WHERE
-                        name IN %s
+                        name = ANY(%s)
                 )
-        ''', self.user_id, tuple(groups))
+        ''', self.user_id, list(groups))
 
     @coroutine
     def get_detail(self):
@@ -371,21 +436,8 @@ class Avatar(Row):
             'avatar_type'
     ]
 
-    @coroutine
     def get_hashes(self):
-        hashes = yield AvatarHash.fetch(self._db,
-                '''
-                hash_id IN (
-                    SELECT
-                        hash_id
-                    FROM
-                        "avatar_hash_assoc"
-                    WHERE
-                        avatar_id=%s
-                )''', self.avatar_id)
-        raise Return(dict([
-            (h.hashalgo, h) for h in hashes
-        ]))
+        return AvatarHash.fetch_for_avatar(self._db, self.avatar_id)
 
 
 class AvatarHash(Row):
@@ -400,6 +452,27 @@ class AvatarHash(Row):
             'hashdata'
     ]
 
+    @classmethod
+    @coroutine
+    def fetch_for_avatar(cls, db, avatar_id):
+        """
+        Return the hashes of the given avatar as a dict keyed by algorithm,
+        without having to load the avatar itself.
+        """
+        hashes = yield cls.fetch(db,
+                '''
+                hash_id IN (
+                    SELECT
+                        hash_id
+                    FROM
+                        "avatar_hash_assoc"
+                    WHERE
+                        avatar_id=%s
+                )''', avatar_id)
+        raise Return(dict([
+            (h.hashalgo, h) for h in hashes
+        ]))
+
     @property
     def hashstr(self):
         return base64.a85encode(self.hashdata)
@@ -447,6 +520,17 @@ class NewUser(Row):
     ]
 
 
+class DeletedUser(Row):
+    """
+    A record of a user whose profile no longer exists.
+    """
+    _TABLE_         = 'deleted_user'
+    _PRIMARY_KEYS_  = ['user_id']
+    _COLUMNS_       = [
+            'user_id'
+    ]
+
+
 class Hostname(Row):
     """
     A hostname that appears in the links of user profiles.
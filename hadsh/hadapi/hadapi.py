@@ -108,6 +108,13 @@ class HackadayAPI(object):
         # Otherwise, this stores when the "forbidden" flag expires.
         self._forbidden_expiry = None
 
+    @property
+    def client(self):
+        """
+        Return the HTTP client used for requests, so that it may be shared.
+        """
+        return self._client
+
     @property
     def is_forbidden(self):
         """
@@ -152,12 +159,9 @@ class HackadayAPI(object):
 
         This is primarily to support retrieval of avatars and other data
         without hitting the HAD.io site needlessly hard.
-        """
-        if 'connect_timeout' not in kwargs:
-            kwargs['connect_timeout'] = 120.0
-        if 'request_timeout' not in kwargs:
-            kwargs['request_timeout'] = 120.0
 
+        Timeouts not given in kwargs are those configured for the client.
+        """
         try:
             yield self._rq_sem.acquire()
             while True:
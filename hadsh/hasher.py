@@ -20,12 +20,22 @@ class ImageHasher(object):
 
     @coroutine
     def hash(self, avatar, algorithm):
+        hashes = yield self.hash_all(avatar, (algorithm,))
+        raise Return(hashes[algorithm])
+
+    @coroutine
+    def hash_all(self, avatar, algorithms):
+        """
+        Compute several hashes of the avatar at once, decoding the image
+        no more than once.  Returns a dict of hash data by algorithm.
+        """
         log = self._log.getChild('avatar[%d]' % avatar.avatar_id)
         future = Future()
 
-        if not (hasattr(imagehash, algorithm) or \
-                hasattr(hashlib, algorithm)):
-            raise ValueError('unknown algorithm %s' % algorithm)
+        for algorithm in algorithms:
+            if not (hasattr(imagehash, algorithm) or \
+                    hasattr(hashlib, algorithm)):
+                raise ValueError('unknown algorithm %s' % algorithm)
 
         # Handing the value back to the coroutine
         def _on_done(result):
@@ -37,30 +47,33 @@ class ImageHasher(object):
                 future.set_result(result)
 
         # What to do in the thread pool
-        def _do_hash(image_data, algorithm):
+        def _do_hash(image_data, algorithms):
             try:
-                if hasattr(hashlib, algorithm):
-                    algofunc = getattr(hashlib, algorithm)
-                    self._io_loop.add_callback(_on_done,
-                            algofunc(image_data).digest())
-                else:
-                    log.audit('Opening image')
-                    image = Image.open(BytesIO(image_data))
+                hashes = {}
+                image = None
+                for algorithm in algorithms:
+                    if hasattr(hashlib, algorithm):
+                        algofunc = getattr(hashlib, algorithm)
+                        hashes[algorithm] = algofunc(image_data).digest()
+                    else:
+                        if image is None:
+                            log.audit('Opening image')
+                            image = Image.open(BytesIO(image_data))
 
-                    algofunc = getattr(imagehash, algorithm)
-                    res = algofunc(image)
+                        algofunc = getattr(imagehash, algorithm)
+                        hashes[algorithm] = binascii.a2b_hex(
+                                str(algofunc(image)))
 
-                    self._io_loop.add_callback(_on_done,
-                            binascii.a2b_hex(str(res)))
+                self._io_loop.add_callback(_on_done, hashes)
             except:
                 log.exception('Failed to hash')
                 self._io_loop.add_callback(_on_done, exc_info())
 
         # Run the above in the thread pool:
-        yield self._pool.apply(_do_hash, (avatar.avatar, algorithm))
+        yield self._pool.apply(_do_hash, (avatar.avatar, tuple(algorithms)))
 
         # Wait for the result
-        hash_data = yield future
+        hashes = yield future
 
         # Return the data
-        raise Return(hash_data)
+        raise Return(hashes)
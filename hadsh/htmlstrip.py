@@ -41,6 +41,12 @@ class HTMLTextExtractor(HTMLParser):
 
 
 def html_to_text(html):
+    if ('<' not in html) and ('&' not in html):
+        # No tags or entities, so nothing for the parser to do.
+        return html
+
     s = HTMLTextExtractor()
     s.feed(html)
+    # Flush any text the parser is holding back.
+    s.close()
     return s.get_text()
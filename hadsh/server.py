@@ -4,13 +4,18 @@ import base64
 import argparse
 import uuid
 import datetime
-import pytz
 import json
 import functools
 import os
 
 from passlib.context import CryptContext
 
+try:
+    import pycurl
+except ImportError:
+    # Fall back to the simple HTTP client
+    pycurl = None
+
 from tornado.web import Application, RequestHandler, \
         RedirectHandler, MissingArgumentError
 from tornado.httpclient import AsyncHTTPClient, HTTPError
@@ -68,7 +73,7 @@ class AuthRequestHandler(RequestHandler):
         (user_id, expiry_date) = session[0]
 
         # Is the session within a day of expiry?
-        now = datetime.datetime.now(tz=pytz.utc)
+        now = datetime.datetime.now(datetime.timezone.utc)
         expiry_secs = (expiry_date - now).total_seconds()
         if expiry_secs < 0:
             # Session is defunct.
@@ -165,7 +170,7 @@ class LoginHandler(RequestHandler):
 
         # We have the user account, create the session
         session_id = uuid.uuid4()
-        expiry = datetime.datetime.now(tz=pytz.utc) \
+        expiry = datetime.datetime.now(datetime.timezone.utc) \
                 + datetime.timedelta(days=7)
         yield db.query('''
             INSERT INTO "session"
@@ -624,11 +629,11 @@ class UserBrowserHandler(AuthRequestHandler):
                                     FROM
                                         "group"
                                     WHERE
-                                        name in %s
+                                        name = ANY(%s)
                                 )
                         )
                     '''
-            query_args = [tuple(groups)]
+            query_args = [list(groups)]
 
             if before_user_id is not None:
                 query_str += '''
@@ -941,7 +946,7 @@ class CallbackHandler(RequestHandler):
                 user_data)
 
         # We have the user account, create the session
-        expiry = datetime.datetime.now(tz=pytz.utc) \
+        expiry = datetime.datetime.now(datetime.timezone.utc) \
                 + datetime.timedelta(days=7)
         session_id = uuid.uuid4()
 
@@ -968,20 +973,53 @@ class HADSHApp(Application):
     def __init__(self, db_uri, project_id, admin_uid,
             client_id, client_secret, api_key, api_rq_interval,
             domain, secure, static_uri, static_path,
-            thread_count, crawler_config, **kwargs):
+            thread_count, crawler_config, http_max_clients=10,
+            http_max_host_clients=8, http_dns_cache_timeout=300,
+            http_connect_timeout=120.0, http_request_timeout=120.0,
+            db_pool_size=Database.POOL_SIZE,
+            db_max_overflow=Database.MAX_OVERFLOW,
+            db_pool_recycle=Database.POOL_RECYCLE, **kwargs):
         self._log = extdlog.getLogger(self.__class__.__name__)
         # Database connection
-        self._db = Database(db_uri, log=self._log.getChild('db'))
+        self._db = Database(db_uri, pool_size=db_pool_size,
+                max_overflow=db_max_overflow, pool_recycle=db_pool_recycle,
+                log=self._log.getChild('db'))
         # Session management connection
         self._pool = WorkerPool(thread_count)
         self._hasher = ImageHasher(self._log.getChild('hasher'), self._pool)
+        # Use the cURL client where available, as it keeps connections
+        # alive between requests.
+        if pycurl is not None:
+            def _prepare_curl(curl):
+                # Avoid looking up the same few hosts over and over.
+                curl.setopt(pycurl.DNS_CACHE_TIMEOUT, http_dns_cache_timeout)
+        else:
+            _prepare_curl = None
+
         AsyncHTTPClient.configure(
-                None, defaults=dict(
+                'tornado.curl_httpclient.CurlAsyncHTTPClient' \
+                        if pycurl is not None else None,
+                max_clients=http_max_clients,
+                defaults=dict(
+                    connect_timeout=http_connect_timeout,
+                    request_timeout=http_request_timeout,
+                    prepare_curl_callback=_prepare_curl,
                     user_agent="HADSH/0.0.1 (https://hackaday.io/project/29161-hackadayio-spambot-hunter-project)"))
+        client = AsyncHTTPClient()
+        # Tornado doesn't expose the cURL multi handle, so only tune it
+        # if this client has one we can reach.
+        multi = getattr(client, '_multi', None)
+        if (pycurl is not None) and (multi is not None):
+            # Have cURL hang on to as many connections as we have clients.
+            multi.setopt(pycurl.M_MAXCONNECTS, http_max_clients)
+            if hasattr(pycurl, 'M_MAX_HOST_CONNECTIONS'):
+                # Don't hog any one host; cURL queues the excess.
+                multi.setopt(pycurl.M_MAX_HOST_CONNECTIONS,
+                        http_max_host_clients)
         self._api = HackadayAPI(client_id=client_id,
                 client_secret=client_secret, api_key=api_key,
                 rqlim_time=api_rq_interval,
-                client=AsyncHTTPClient(), log=self._log.getChild('api'))
+                client=client, log=self._log.getChild('api'))
         self._crawler = Crawler(project_id, admin_uid, self._db,
                 self._api, self._hasher, self._log.getChild('crawler'),
                 config=crawler_config)
@@ -1037,6 +1075,15 @@ def main(*args, **kwargs):
             help='Use cleartext HTTP not HTTPS')
     parser.add_argument('--db-uri', dest='db_uri',
             help='Back-end database URI')
+    parser.add_argument('--db-pool-size', dest='db_pool_size', type=int,
+            default=Database.POOL_SIZE,
+            help='Number of idle database connections to keep.')
+    parser.add_argument('--db-max-overflow', dest='db_max_overflow',
+            type=int, default=Database.MAX_OVERFLOW,
+            help='Extra database connections allowed when busy.')
+    parser.add_argument('--db-pool-recycle', dest='db_pool_recycle',
+            type=float, default=Database.POOL_RECYCLE,
+            help='Maximum age of a pooled database connection (seconds).')
     parser.add_argument('--client-id', dest='client_id',
             help='Hackaday.io client ID')
     parser.add_argument('--client-secret', dest='client_secret',
@@ -1054,6 +1101,22 @@ def main(*args, **kwargs):
             default='INFO', help='Logging level')
     parser.add_argument('--thread-count', dest='thread_count', type=int,
             default=8, help='Number of concurrent threads.')
+    parser.add_argument('--http-max-clients', dest='http_max_clients',
+            type=int, default=10,
+            help='Maximum number of concurrent HTTP connections.')
+    parser.add_argument('--http-max-host-clients',
+            dest='http_max_host_clients', type=int, default=8,
+            help='Maximum number of concurrent HTTP connections per host '
+                '(cURL client only).')
+    parser.add_argument('--http-dns-cache-timeout',
+            dest='http_dns_cache_timeout', type=int, default=300,
+            help='Time (seconds) to cache DNS lookups (cURL client only).')
+    parser.add_argument('--http-connect-timeout',
+            dest='http_connect_timeout', type=float, default=120.0,
+            help='Time limit (seconds) on establishing HTTP connections.')
+    parser.add_argument('--http-request-timeout',
+            dest='http_request_timeout', type=float, default=120.0,
+            help='Time limit (seconds) on completing HTTP requests.')
     parser.add_argument('--static-uri', dest='static_uri', type=str,
             help='Static resource URI', default='/static/')
     parser.add_argument('--static-path', dest='static_path', type=str,
@@ -1107,6 +1170,14 @@ def main(*args, **kwargs):
             static_uri=args.static_uri,
             template_path=args.template_path,
             thread_count=args.thread_count,
+            http_max_clients=args.http_max_clients,
+            http_max_host_clients=args.http_max_host_clients,
+            http_dns_cache_timeout=args.http_dns_cache_timeout,
+            http_connect_timeout=args.http_connect_timeout,
+            http_request_timeout=args.http_request_timeout,
+            db_pool_size=args.db_pool_size,
+            db_max_overflow=args.db_max_overflow,
+            db_pool_recycle=args.db_pool_recycle,
             crawler_config=crawler_config
     )
     http_server = HTTPServer(application)
@@ -107,6 +107,22 @@ class Trait(object):
         log.audit('User %s has %s', user, user_traits)
         raise Return(user_traits)
 
+    @staticmethod
+    @coroutine
+    def persist_many(db, user_traits):
+        """
+        Persist the counts of several user trait instances, with one
+        statement per table.
+        """
+        rows = {}
+        for user_trait in user_traits:
+            (row_class, row) = user_trait._persist_row()
+            # Later counts win, as they would for separate persist() calls.
+            rows.setdefault(row_class, {})[row[:-1]] = row
+
+        for (row_class, class_rows) in rows.items():
+            yield row_class.upsert(db, list(class_rows.values()))
+
     @coroutine
     def _assess(self, user, log):
         """
@@ -151,6 +167,9 @@ class BaseTraitInstance(object):
     """
     An instance of a given trait, linked to a user.
     """
+    # Many of these are created while inspecting users, keep them small.
+    __slots__ = ('_trait',)
+
     def __init__(self, trait):
         assert isinstance(trait, Trait)
         self._trait = trait
@@ -187,6 +206,8 @@ class BaseUserTraitInstance(object):
     """
     An instance of a trait linked to a user.
     """
+    __slots__ = ('_user_id', '_trait_instance', '_count', '_user_trait_id')
+
     def __init__(self, user, trait_instance, count):
         assert isinstance(trait_instance, BaseTraitInstance)
         self._user_id = user.user_id
@@ -204,11 +225,13 @@ class BaseUserTraitInstance(object):
 
     @property
     def weighted_score(self):
-        if self.trait_count == 0:
+        trait_instance = self._trait_instance
+        trait_count = trait_instance.count
+        if trait_count == 0:
             return 0.0
 
-        return (float(self.trait_score) * self.trait.weight) \
-                / float(self.trait_count)
+        return (float(trait_instance.score) * trait_instance.trait.weight) \
+                / float(trait_count)
 
     @property
     def trait_score(self):
@@ -233,11 +256,16 @@ class BaseUserTraitInstance(object):
         """
         raise NotImplementedError()
 
-    @coroutine
     def persist(self):
         """
         Persist this user trait instance count in the database.
         """
+        return Trait.persist_many(self._db, [self])
+
+    def _persist_row(self):
+        """
+        Return the model class and row used to persist this instance.
+        """
         raise NotImplementedError()
 
     @coroutine
@@ -257,6 +285,8 @@ class TraitInstance(BaseTraitInstance):
     """
     An instance of a given trait.
     """
+    __slots__ = ('_instance', '_log')
+
     def __init__(self, trait, instance):
         super(TraitInstance, self).__init__(trait)
         self._instance = instance
@@ -298,6 +328,8 @@ class UserTraitInstance(BaseUserTraitInstance):
     """
     An instance of a trait linked to a user.
     """
+    __slots__ = ()
+
     @coroutine
     def discard(self):
         yield self._db.query('''
@@ -311,31 +343,9 @@ class UserTraitInstance(BaseUserTraitInstance):
                 self._trait_instance.trait_inst_id,
                 commit=True)
 
-    @coroutine
-    def persist(self):
-        """
-        Persist this user trait instance count in the database.
-        """
-        yield self._db.query('''
-            INSERT INTO "user_trait_instance"
-                (user_id, trait_inst_id, count)
-            VALUES
-                (%s, %s, %s)
-            ON CONFLICT DO UPDATE
-            SET
-                count=%s
-            WHERE
-                user_id=%s
-            AND
-                trait_inst_id=%s
-                ''',
-                self._user_id,
-                self._trait_instance.trait_inst_id,
-                self.count,
-                self.count,
-                self._user_id,
-                self._trait_instance.trait_inst_id,
-                commit=True)
+    def _persist_row(self):
+        return (model.UserTraitInstance, (self._user_id,
+            self._trait_instance.trait_inst_id, self.count))
 
 
 class SingletonTrait(Trait):
@@ -372,6 +382,8 @@ class SingletonTraitInstance(BaseTraitInstance):
     """
     An instance of a given singleton trait.
     """
+    __slots__ = ()
+
     def __init__(self, trait):
         super(SingletonTraitInstance, self).__init__(trait)
 
@@ -398,6 +410,8 @@ class UserSingletonTraitInstance(BaseUserTraitInstance):
     """
     A singleton trait linked to a user.
     """
+    __slots__ = ()
+
 
     @coroutine
     def discard(self):
@@ -415,28 +429,6 @@ class UserSingletonTraitInstance(BaseUserTraitInstance):
                 self._trait_instance.trait.trait_id,
                 commit=True)
 
-    @coroutine
-    def persist(self):
-        """
-        Persist this user trait instance count in the database.
-        """
-        yield self._db.query('''
-            INSERT INTO "user_trait"
-                (user_id, trait_id, count)
-            VALUES
-                (%s, %s, %s)
-            ON CONFLICT DO UPDATE
-            SET
-                count=%s
-            WHERE
-                user_id=%s
-            AND
-                trait_id=%s
-                ''',
-                self._user_id,
-                self._trait_instance.trait.trait_id,
-                self.count,
-                self.count,
-                self._user_id,
-                self._trait_instance.trait.trait_id,
-                commit=True)
+    def _persist_row(self):
+        return (model.UserTrait, (self._user_id,
+            self._trait_instance.trait.trait_id, self.count))
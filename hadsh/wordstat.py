@@ -3,12 +3,17 @@
 from .htmlstrip import html_to_text
 from polyglot.text import Text
 from string import punctuation
+from collections import Counter
+from itertools import islice
 
 
 def stripunprintable(s):
     """
     Strip non-printable characters
     """
+    if s.isprintable():
+        # Nothing to strip, skip the character-by-character scan.
+        return s
     return ''.join(c for c in s if c.isprintable())
 
 
@@ -17,27 +22,35 @@ def tokenise(html_text):
     Return a list of words that appear in the text.
     """
     try:
-        return list(
-                filter(lambda w : w not in punctuation,
-                    Text(stripunprintable(
-                        html_to_text(html_text))
-                    ).lower().words))
+        return [
+                w for w in Text(stripunprintable(
+                    html_to_text(html_text))).lower().words
+                if w not in punctuation
+        ]
     except ValueError:
         # Empty sequence?
         return []
 
 
+def _count(items, freq):
+    """
+    Add the items to the counts in freq.  A Counter does this in C; any
+    other mapping is counted up one item at a time.
+    """
+    if isinstance(freq, Counter):
+        freq.update(items)
+    else:
+        for item in items:
+            freq[item] = freq.get(item, 0) + 1
+
+
 def frequency(wordlist, freq=None):
     """
     Scan the word list given and count how often each word appears.
     """
     if freq is None:
-        freq = {}
-    for w in wordlist:
-        try:
-            freq[w] += 1
-        except KeyError:
-            freq[w] = 1
+        freq = Counter()
+    _count(wordlist, freq)
     return freq
 
 
@@ -46,10 +59,7 @@ def adjacency(wordlist, freq=None):
     Scan the word list and count how often each pair of words appears.
     """
     if freq is None:
-        freq = {}
-    for prev_w, next_w in zip(wordlist[:-1], wordlist[1:]):
-        try:
-            freq[(prev_w, next_w)] += 1
-        except KeyError:
-            freq[(prev_w, next_w)] = 1
+        freq = Counter()
+    # Pair each word with its successor without copying the list.
+    _count(zip(wordlist, islice(wordlist, 1, None)), freq)
     return freq